@@ -0,0 +1,78 @@
+import argparse
+import csv
+import glob
+import os
+import time
+
+import marching_cubes
+
+def load_volume(path, crop):
+    reader = marching_cubes.get_reader(path)
+    reader.Update()
+    image = reader.GetOutput()
+    return marching_cubes.AutoCrop(image, 1) if crop == "auto" else image
+
+def time_backend(image, threshold, backend, repeats):
+    """(best wall time in s, triangles) of a contour backend over repeats runs."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        polydata = marching_cubes.Contour(image, threshold, backend)
+        times.append(time.perf_counter() - start)
+    return min(times), polydata.GetNumberOfCells()
+
+def run_benchmark(inputs, backends, threshold=1, crop="none", threads=(None,), repeats=3):
+    rows = []
+    for path in inputs:
+        image = load_volume(path, crop)
+        voxels = image.GetNumberOfPoints()
+        for thread_count in threads:
+            marching_cubes.UseThreads(thread_count)
+            reference = None
+            for backend in backends:
+                try:
+                    elapsed, triangles = time_backend(image, threshold, backend, repeats)
+                except (ImportError, ValueError) as error:
+                    print(f"Skipping {backend}: {error}")
+                    continue
+                reference = reference or elapsed
+                rows.append({
+                    "input": path,
+                    "dimensions": "x".join(str(d) for d in image.GetDimensions()),
+                    "crop": crop,
+                    "threads": thread_count or os.cpu_count(),
+                    "backend": backend,
+                    "triangles": triangles,
+                    "time_s": elapsed,
+                    "mvoxels_per_s": voxels / elapsed / 1e6,
+                    "speedup": reference / elapsed,
+                })
+                print(f"{os.path.basename(path)} {rows[-1]['dimensions']} threads={rows[-1]['threads']} "
+                      f"{backend:>22}: {elapsed:.3f}s, {rows[-1]['mvoxels_per_s']:.0f} Mvoxels/s, "
+                      f"{triangles} triangles, x{rows[-1]['speedup']:.1f}")
+    return rows
+
+def write_results(rows, output_path):
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Saved {len(rows)} results to {output_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Contouring throughput of each marching_cubes.py backend.")
+    parser.add_argument("inputs", nargs="*", help="Volumes (default: image_filtering/filtered_dicom/*.vtk).")
+    parser.add_argument("--backends", nargs="+", default=list(marching_cubes.CONTOUR_BACKENDS),
+                        choices=list(marching_cubes.CONTOUR_BACKENDS), help="The first one is the reference of the speedups.")
+    parser.add_argument("--threshold", type=float, default=1)
+    parser.add_argument("--crop", choices=["none", "auto"], default="none")
+    parser.add_argument("--threads", type=int, nargs="+", default=[None], help="Thread counts of the VTK SMP filters.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default=os.path.join("3D", "benchmark", "contour.csv"))
+    args = parser.parse_args()
+
+    inputs = args.inputs or sorted(glob.glob(os.path.join("image_filtering", "filtered_dicom", "*.vtk")))
+    rows = run_benchmark(inputs, args.backends, args.threshold, args.crop, args.threads, args.repeats)
+    if rows:
+        write_results(rows, args.output)
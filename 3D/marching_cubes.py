@@ -1,17 +1,112 @@
+import argparse
+import inspect
+import time
 import vtk
 import sys
 import os
+import numpy as np
+import scipy.sparse
+from vtk.util import numpy_support
+import SimpleITK as sitk
 
-def MarchingCubes(image, threshold, selective_regions=False):
+# parallel DICOM loader (image_filtering/dicom_loader.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image_filtering"))
+from dicom_loader import read_series_parallel
+from volume_store import ChunkedVolume, is_store
+from surface_io import SURFACE_FORMATS, write_surface
+
+SMOOTHING_ITERATIONS = 100
+SMOOTHING_RELAXATION = 0.1
+# windowed-sinc: few iterations, low pass band (0 to 2, lower is smoother), no shrinkage
+WINDOWED_SINC_ITERATIONS = 20
+WINDOWED_SINC_PASS_BAND = 0.05
+# Taubin lambda|mu: alternate shrinking and inflating Laplacian steps
+TAUBIN_ITERATIONS = 30
+TAUBIN_LAMBDA = 0.5
+TAUBIN_MU = -0.53
+# voxels kept around the bounding box: with 2, the gradients (central differences) and so the
+# surface are the same as on the whole volume
+CROP_MARGIN = 2
+# more distinct values than this above the threshold: a grayscale volume, not a label image
+MAX_DISCRETE_LABELS = 256
+
+def _run_contour(contour_filter, image, values):
+    contour_filter.SetInputData(image)
+    contour_filter.ComputeNormalsOn()
+    for i, value in enumerate(values):
+        contour_filter.SetValue(i, value)
+    contour_filter.Update()
+    return contour_filter.GetOutput()
+
+def VtkMarchingCubes(image, threshold):
     mc = vtk.vtkMarchingCubes()
-    mc.SetInputData(image)
-    mc.ComputeNormalsOn()
     mc.ComputeGradientsOn()
-    mc.SetValue(0, threshold)
-    mc.Update()
+    return _run_contour(mc, image, [threshold])
+
+def FlyingEdges(image, threshold):
+    """Same isosurface as marching cubes, computed in a few passes over the x edges, multi-threaded (vtkSMPTools)."""
+    return _run_contour(vtk.vtkFlyingEdges3D(), image, [threshold])
+
+def DiscreteFlyingEdges(image, threshold):
+    """
+    Label map surfaces: one surface per label value >= threshold (the mask value of a binary mask),
+    between voxels of different labels, without interpolation (blocky until smoothed). Only for
+    integer label images: on a grayscale volume every intensity would give its own surface.
+    """
+    array = ImageArray(image)
+    if not np.issubdtype(array.dtype, np.integer):
+        raise ValueError(f"discrete_flying_edges needs an integer label image, not {array.dtype} voxels")
+    labels = np.unique(array[array >= threshold])  # only the (few) foreground voxels are sorted
+    if len(labels) > MAX_DISCRETE_LABELS:
+        raise ValueError(f"{len(labels)} distinct values >= {threshold}: discrete_flying_edges needs a mask or "
+                         f"a label image, not a grayscale volume")
+    return _run_contour(vtk.vtkDiscreteFlyingEdges3D(), image, labels.tolist())
+
+def SkimageMarchingCubes(image, threshold):
+    """skimage.measure.marching_cubes (optional dependency) with the vertices in physical coordinates."""
+    try:
+        from skimage.measure import marching_cubes
+    except ImportError:
+        raise ImportError("The skimage contour backend needs scikit-image: pip install scikit-image")
+    array = ImageArray(image)
+    if array.max() < threshold or array.min() > threshold:
+        return vtk.vtkPolyData()
+    verts, faces, normals, _ = marching_cubes(array, threshold, allow_degenerate=False)
+    # (z, y, x) indices of the image extent -> (x, y, z) physical points
+    extent = np.array(image.GetExtent()[::2])
+    points = np.asarray(image.GetOrigin()) + (verts[:, ::-1] + extent) * np.asarray(image.GetSpacing())
+
+    polydata = vtk.vtkPolyData()
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_support.numpy_to_vtk(points.astype(np.float32), deep=True))
+    polydata.SetPoints(vtk_points)
+    polys = vtk.vtkCellArray()
+    # with the axes reversed, the skimage triangles have the orientation of the VTK ones
+    polys.SetData(numpy_support.numpy_to_vtkIdTypeArray(np.arange(0, 3 * len(faces) + 1, 3, dtype=np.int64), deep=True),
+                  numpy_support.numpy_to_vtkIdTypeArray(faces.astype(np.int64).ravel(), deep=True))
+    polydata.SetPolys(polys)
+    vtk_normals = numpy_support.numpy_to_vtk(np.ascontiguousarray(normals[:, ::-1]), deep=True)
+    vtk_normals.SetName("Normals")
+    polydata.GetPointData().SetNormals(vtk_normals)
+    return polydata
+
+# contour backend name -> function(vtkImageData, threshold) -> vtkPolyData
+CONTOUR_BACKENDS = {
+    "marching_cubes": VtkMarchingCubes,
+    "flying_edges": FlyingEdges,
+    "discrete_flying_edges": DiscreteFlyingEdges,
+    "skimage": SkimageMarchingCubes,
+}
 
+def Contour(image, threshold, backend="marching_cubes"):
+    return CONTOUR_BACKENDS[backend](image, threshold)
+
+def MarchingCubes(image, threshold, selective_regions=False, backend="marching_cubes"):
+    return KeepRegions(Contour(image, threshold, backend), selective_regions)
+
+def KeepRegions(polydata, selective_regions=False):
     confilter = vtk.vtkPolyDataConnectivityFilter()
-    confilter.SetInputData(mc.GetOutput())
+    confilter.SetInputData(polydata)
     if selective_regions:
         confilter.SetExtractionModeToAllRegions()
     else:
@@ -21,16 +116,132 @@ def MarchingCubes(image, threshold, selective_regions=False):
 
     return confilter.GetOutput()
 
-def Smooth_stl(polydata):
+def UseThreads(threads=None):
+    """Run the SMP filters of VTK (windowed-sinc, flying edges...) on threads, all the cores if None."""
+    smp = vtk.vtkSMPTools()
+    smp.SetBackend("STDThread")
+    smp.Initialize(threads or os.cpu_count() or 1)
+
+def Smooth_stl(polydata, iterations=SMOOTHING_ITERATIONS, relaxation=SMOOTHING_RELAXATION):
     smoothFilter = vtk.vtkSmoothPolyDataFilter()
     smoothFilter.SetInputData(polydata)
-    smoothFilter.SetNumberOfIterations(100)
-    smoothFilter.SetRelaxationFactor(0.1)
+    smoothFilter.SetNumberOfIterations(iterations)
+    smoothFilter.SetRelaxationFactor(relaxation)
+    smoothFilter.FeatureEdgeSmoothingOff()
+    smoothFilter.BoundarySmoothingOn()
+    smoothFilter.Update()
+    return smoothFilter.GetOutput()
+
+def WindowedSinc(polydata, iterations=WINDOWED_SINC_ITERATIONS, pass_band=WINDOWED_SINC_PASS_BAND):
+    """Windowed-sinc low-pass smoothing (vtkWindowedSincPolyDataFilter, multi-threaded), keeps the volume of thin vessels."""
+    smoothFilter = vtk.vtkWindowedSincPolyDataFilter()
+    smoothFilter.SetInputData(polydata)
+    smoothFilter.SetNumberOfIterations(iterations)
+    smoothFilter.SetPassBand(pass_band)
+    smoothFilter.NormalizeCoordinatesOn()
     smoothFilter.FeatureEdgeSmoothingOff()
     smoothFilter.BoundarySmoothingOn()
+    smoothFilter.NonManifoldSmoothingOn()
     smoothFilter.Update()
     return smoothFilter.GetOutput()
 
+def Taubin(polydata, iterations=TAUBIN_ITERATIONS, lambda_factor=TAUBIN_LAMBDA, mu_factor=TAUBIN_MU):
+    """
+    Taubin lambda|mu smoothing of a triangle mesh: each iteration is a Laplacian step of factor
+    lambda then one of factor mu < -lambda, which cancels the shrinkage. The umbrella operator
+    (mean of the neighbours) is a sparse matrix applied to every vertex at once. The point
+    normals, if any, are recomputed on the smoothed mesh.
+    """
+    if polydata.GetNumberOfPoints() == 0:
+        return polydata
+    points = numpy_support.vtk_to_numpy(polydata.GetPoints().GetData()).astype(np.float64)
+    triangles = numpy_support.vtk_to_numpy(polydata.GetPolys().GetConnectivityArray()).reshape(-1, 3)
+    edges = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    n = len(points)
+    adjacency = scipy.sparse.coo_matrix((np.ones(2 * len(edges)), (np.r_[edges[:, 0], edges[:, 1]],
+                                                                   np.r_[edges[:, 1], edges[:, 0]])), shape=(n, n)).tocsr()
+    adjacency.data[:] = 1  # edges shared by two triangles were summed
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    umbrella = scipy.sparse.diags(1 / np.maximum(degree, 1)) @ adjacency
+    for _ in range(iterations):
+        for factor in (lambda_factor, mu_factor):
+            points += factor * (umbrella @ points - points)
+
+    smoothed = vtk.vtkPolyData()
+    smoothed.ShallowCopy(polydata)
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_support.numpy_to_vtk(points.astype(np.float32), deep=True))
+    smoothed.SetPoints(vtk_points)
+    if polydata.GetPointData().GetNormals() is None:
+        return smoothed
+    normals = vtk.vtkPolyDataNormals()
+    normals.SetInputData(smoothed)
+    normals.ComputePointNormalsOn()
+    normals.ComputeCellNormalsOff()
+    normals.SplittingOff()  # same points as the input
+    normals.ConsistencyOff()
+    normals.Update()
+    return normals.GetOutput()
+
+# smoother name -> function(polydata, iterations, **params)
+SMOOTHERS = {
+    "laplacian": Smooth_stl,
+    "windowed_sinc": WindowedSinc,
+    "taubin": Taubin,
+}
+
+def Decimate(polydata, target_triangles):
+    """Quadric decimation (vtkQuadricDecimation, volume preserving) down to about target_triangles."""
+    triangles = polydata.GetNumberOfCells()
+    if target_triangles >= triangles:
+        return polydata
+    decimate = vtk.vtkQuadricDecimation()
+    decimate.SetInputData(polydata)
+    decimate.SetTargetReduction(1 - target_triangles / triangles)
+    decimate.VolumePreservationOn()
+    decimate.Update()
+    return decimate.GetOutput()
+
+def MeshVolume(polydata):
+    if polydata.GetNumberOfCells() == 0:
+        return 0.0
+    mass = vtk.vtkMassProperties()
+    mass.SetInputData(polydata)
+    mass.Update()
+    return mass.GetVolume()
+
+def PostProcess(polydata, smoother="laplacian", iterations=None, target_triangles=None, release=False, **smoother_params):
+    """
+    Smoothing (SMOOTHERS) then, if target_triangles is given, quadric decimation. Prints the
+    triangle count, enclosed volume and time of each step. With release, the input mesh and each
+    intermediate one are freed as soon as the next one is computed (the input is then left empty),
+    so that only two meshes are in memory at a time.
+    """
+    unknown = set(smoother_params) - set(inspect.signature(SMOOTHERS[smoother]).parameters)
+    if unknown:
+        raise ValueError(f"{smoother} smoother has no parameter {', '.join(sorted(unknown))}")
+    if polydata.GetNumberOfCells() == 0:
+        print("empty mesh: no post-processing")
+        return polydata
+    if iterations is not None:
+        smoother_params["iterations"] = iterations
+    steps = [(smoother, lambda poly: SMOOTHERS[smoother](poly, **smoother_params))]
+    if target_triangles:
+        steps.append(("quadric decimation", lambda poly: Decimate(poly, target_triangles)))
+
+    triangles, volume = polydata.GetNumberOfCells(), MeshVolume(polydata)
+    for name, step in steps:
+        start = time.perf_counter()
+        previous, polydata = polydata, step(polydata)
+        elapsed = time.perf_counter() - start
+        if release and previous is not polydata:
+            previous.ReleaseData()
+        new_triangles, new_volume = polydata.GetNumberOfCells(), MeshVolume(polydata)
+        print(f"{name}: {triangles} -> {new_triangles} triangles, volume {volume:.1f} -> {new_volume:.1f} mm3 "
+              f"({100 * (new_volume / volume - 1) if volume else 0:+.1f}%), {elapsed:.2f}s")
+        triangles, volume = new_triangles, new_volume
+    return polydata
+
 def CountRegions(polydata):
     confilter = vtk.vtkPolyDataConnectivityFilter()
     confilter.SetInputData(polydata)
@@ -60,11 +271,231 @@ def CropVolume(image, voi):
     extractor.Update()
     return extractor.GetOutput()
 
-def get_reader(input_path):
-    if os.path.isdir(input_path):
+def ImageArray(image):
+    """(z, y, x) NumPy view of the scalars of a vtkImageData."""
+    nx, ny, nz = image.GetDimensions()
+    return numpy_support.vtk_to_numpy(image.GetPointData().GetScalars()).reshape(nz, ny, nx)
+
+def _margin_voi(image, lower, upper, margin):
+    """VOI (xmin, xmax, ymin, ymax, zmin, zmax) in extent indices of the (z, y, x) box [lower, upper) plus margin."""
+    extent = image.GetExtent()
+    voi = []
+    for axis in range(3):
+        start, end = extent[2*axis], extent[2*axis + 1]
+        voi += [max(start, start + lower[2 - axis] - margin), min(end, start + upper[2 - axis] - 1 + margin)]
+    return tuple(voi)
+
+def BoundingBox(image, threshold, margin=CROP_MARGIN):
+    """VOI (xmin, xmax, ymin, ymax, zmin, zmax) of the voxels >= threshold plus margin, None if there is none."""
+    inside = ImageArray(image) >= threshold
+    lower, upper = [], []
+    for axis in range(3):
+        occupied = np.flatnonzero(inside.any(axis=tuple(a for a in range(3) if a != axis)))
+        if occupied.size == 0:
+            return None
+        lower.append(int(occupied[0]))
+        upper.append(int(occupied[-1]) + 1)
+    return _margin_voi(image, lower, upper, margin)
+
+def _voi_voxels(voi):
+    return np.prod([voi[2*d + 1] - voi[2*d] + 1 for d in range(3)])
+
+def AutoCrop(image, threshold, margin=CROP_MARGIN):
+    """Sub-volume of the bounding box of the voxels >= threshold (same origin and extent indices as CropVolume)."""
+    voi = BoundingBox(image, threshold, margin)
+    if voi is None:
+        return image
+    print(f"Auto crop VOI {voi}: {100 * _voi_voxels(voi) / image.GetNumberOfPoints():.1f}% of the voxels")
+    return CropVolume(image, voi)
+
+def ArrayToImage(array, image, voi=None):
+    """vtkImageData of a (z, y, x) array with the origin and spacing of image, on its extent or on voi."""
+    out = vtk.vtkImageData()
+    out.SetExtent(voi or image.GetExtent())
+    out.SetOrigin(image.GetOrigin())
+    out.SetSpacing(image.GetSpacing())
+    scalars = numpy_support.numpy_to_vtk(np.ascontiguousarray(array).ravel(), deep=True)
+    scalars.SetName("scalars")
+    out.GetPointData().SetScalars(scalars)
+    return out
+
+def LabelComponents(array, threshold, min_size=0):
+    """
+    Connected components of the voxels >= threshold (26-connectivity, so no marching cubes cell
+    holds two of them), labelled 1, 2, ... by decreasing size; components below min_size voxels are removed.
+    """
+    components = sitk.ConnectedComponent(sitk.GetImageFromArray((array >= threshold).view(np.uint8)), True)
+    return sitk.RelabelComponent(components, minimumObjectSize=min_size, sortByObjectSize=True)
+
+def _background(array, threshold):
+    return min(array.min(), threshold - 1)
+
+def SelectComponents(image, threshold, components=None, min_size=0):
+    """
+    Copy of the image where only the selected connected components (ranks by decreasing size, 1 is the
+    largest; every component of at least min_size voxels if None) stay above the threshold.
+    """
+    array = ImageArray(image)
+    label_image = LabelComponents(array, threshold, min_size)
+    labels = sitk.GetArrayViewFromImage(label_image)  # valid while label_image is alive
+    count = int(labels.max())
+    selected = np.zeros(count + 1, dtype=bool)  # label -> kept
+    selected[[c for c in components if c <= count] if components else slice(1, None)] = True
+    keep = selected[labels]
+    print(f"{count} components of at least {min_size} voxels, keeping {components or 'all'}: "
+          f"{int(keep.sum())} of {int((array >= threshold).sum())} voxels")
+    return ArrayToImage(np.where(keep, array, _background(array, threshold)).astype(array.dtype), image)
+
+def ComponentSurfaces(image, threshold, margin=CROP_MARGIN, components=None, min_size=0, backend="marching_cubes"):
+    """
+    Contour each connected component (see LabelComponents and SelectComponents for the selection) in
+    its own bounding box, the other voxels of the box being set to the background. Returns the appended surfaces.
+    """
+    array = ImageArray(image)
+    label_image = LabelComponents(array, threshold, min_size)
+    if components:
+        # no statistics for the (many, small) components that are not selected
+        label_image = sitk.Threshold(label_image, lower=0, upper=max(components), outsideValue=0)
+    stats = sitk.LabelShapeStatisticsImageFilter()
+    stats.Execute(label_image)
+    labels = sitk.GetArrayViewFromImage(label_image)  # valid while label_image is alive
+    background = _background(array, threshold)
+    extent = image.GetExtent()
+    selected = [label for label in stats.GetLabels() if not components or label in components]
+
+    append = vtk.vtkAppendPolyData()
+    voxels = 0
+    for label in selected:
+        x, y, z, sx, sy, sz = stats.GetBoundingBox(label)
+        voi = _margin_voi(image, (z, y, x), (z + sz, y + sy, x + sx), margin)
+        region = tuple(slice(voi[2*d] - extent[2*d], voi[2*d + 1] - extent[2*d] + 1) for d in (2, 1, 0))
+        sub_array = np.where(labels[region] == label, array[region], background).astype(array.dtype)
+        append.AddInputData(Contour(ArrayToImage(sub_array, image, voi), threshold, backend))
+        voxels += _voi_voxels(voi)
+    print(f"{len(selected)} components contoured in "
+          f"{100 * voxels / image.GetNumberOfPoints():.1f}% of the voxels")
+    append.Update()
+    return append.GetOutput()
+
+def FuseMasks(paths, threshold=1):
+    """
+    Label map of masks on the same grid (e.g. registered on the fixed image): the voxels >= threshold
+    of the i-th mask get the label i + 1, a later mask overwriting the overlap of the previous ones.
+    """
+    fused = first = None
+    for label, path in enumerate(paths, 1):
+        reader = get_reader(path)
+        reader.Update()
+        image = reader.GetOutput()
+        if fused is None:
+            first = image
+            fused = np.zeros(ImageArray(image).shape, dtype=np.uint8 if len(paths) < 256 else np.uint16)
+        elif image.GetDimensions() != first.GetDimensions():
+            raise ValueError(f"{path} dimensions {image.GetDimensions()} do not match {first.GetDimensions()}")
+        fused[ImageArray(image) >= threshold] = label
+    return ArrayToImage(fused, first)
+
+def ComponentLabelMap(image, threshold, components=None, min_size=0):
+    """Label map of the connected components (LabelComponents), only the selected ones if components is given."""
+    label_image = LabelComponents(ImageArray(image), threshold, min_size)
+    if components:
+        label_image = sitk.Threshold(label_image, lower=0, upper=max(components), outsideValue=0)
+    labels = sitk.GetArrayViewFromImage(label_image)  # valid while label_image is alive
+    if components:
+        labels = np.where(np.isin(labels, components), labels, 0)
+    return ArrayToImage(labels.astype(np.uint16 if labels.max() > 255 else np.uint8), image)
+
+def _sub_mesh(points, triangles):
+    """Polydata of some triangles of a mesh, with only the points they use."""
+    used, inverse = np.unique(triangles, return_inverse=True)
+    polydata = vtk.vtkPolyData()
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_support.numpy_to_vtk(points[used], deep=True))
+    polydata.SetPoints(vtk_points)
+    polys = vtk.vtkCellArray()
+    polys.SetData(numpy_support.numpy_to_vtkIdTypeArray(np.arange(0, len(triangles) * 3 + 1, 3, dtype=np.int64), deep=True),
+                  numpy_support.numpy_to_vtkIdTypeArray(inverse.astype(np.int64).ravel(), deep=True))
+    polydata.SetPolys(polys)
+    return polydata
+
+def LabelSurfaces(label_image, labels=None, method="discrete_flying_edges"):
+    """
+    Closed surface of each label (> 0) of a label map, all computed in a single pass over the volume:
+    {label: polydata}. discrete_flying_edges gives one surface per label value, surface_nets
+    (vtkSurfaceNets3D, smoothed) one face per boundary between two labels, shared by both surfaces.
+    """
+    array = ImageArray(label_image)
+    labels = labels or np.unique(array[array > 0]).tolist()
+    start = time.perf_counter()
+    if method == "surface_nets":
+        nets = vtk.vtkSurfaceNets3D()
+        nets.SetInputData(label_image)
+        for i, label in enumerate(labels):
+            nets.SetLabel(i, label)
+        nets.SetOutputMeshTypeToTriangles()
+        nets.Update()
+        output = nets.GetOutput()
+        boundaries = numpy_support.vtk_to_numpy(output.GetCellData().GetArray("BoundaryLabels"))
+    else:
+        contour_filter = vtk.vtkDiscreteFlyingEdges3D()
+        contour_filter.ComputeScalarsOn()
+        output = _run_contour(contour_filter, label_image, labels)
+    print(f"{method}: {output.GetNumberOfCells()} triangles for {len(labels)} labels in {time.perf_counter() - start:.2f}s")
+    if output.GetNumberOfCells() == 0:
+        return {label: vtk.vtkPolyData() for label in labels}
+
+    points = numpy_support.vtk_to_numpy(output.GetPoints().GetData())
+    triangles = numpy_support.vtk_to_numpy(output.GetPolys().GetConnectivityArray()).reshape(-1, 3)
+    surfaces = {}
+    for label in labels:
+        if method == "surface_nets":
+            # the face is oriented for its first label, flipped for the second one
+            faces = np.concatenate([triangles[boundaries[:, 0] == label], triangles[boundaries[:, 1] == label][:, ::-1]])
+        else:
+            faces = triangles[numpy_support.vtk_to_numpy(output.GetPointData().GetScalars())[triangles[:, 0]] == label]
+        surfaces[label] = _sub_mesh(points, faces)
+    return surfaces
+
+def SitkToVtk(image, dicom_order=False):
+    """
+    vtkImageData with the pixels, origin and spacing of a SimpleITK image (like the .vtk files it
+    writes). With dicom_order, the voxel order and origin of vtkDICOMImageReader instead: rows
+    bottom-up, slices in the reverse order and origin at 0. The direction is dropped in both cases.
+    """
+    if dicom_order:
+        # one copy, from the read-only view of the SimpleITK buffer
+        array = np.ascontiguousarray(sitk.GetArrayViewFromImage(image)[::-1, ::-1])
+    else:
+        array = sitk.GetArrayFromImage(image)  # (z, y, x): x varies fastest as in VTK
+    vtk_image = vtk.vtkImageData()
+    vtk_image.SetDimensions(image.GetSize())
+    vtk_image.SetOrigin((0.0, 0.0, 0.0) if dicom_order else image.GetOrigin())
+    vtk_image.SetSpacing(image.GetSpacing())
+    scalars = numpy_support.numpy_to_vtk(array.ravel(), deep=False)
+    scalars.SetName("scalars")
+    vtk_image.GetPointData().SetScalars(scalars)
+    vtk_image._array = array  # keep the buffer alive with the image
+    return vtk_image
+
+def get_reader(input_path, voi=None):
+    """VTK reader (Update()/GetOutput()) of a DICOM folder, a chunked store, .nii or .vtk file."""
+    if is_store(input_path):
+        # only the chunks of the VOI are read from a chunked volume store
+        print(f"Reading chunked volume: {input_path}")
+        volume = ChunkedVolume(input_path)
+        lower, upper = volume.voi_region(voi) if voi else ((0, 0, 0), volume.shape[:3])
+        im = SitkToVtk(volume.read_image(lower, upper))
+        # same origin and extent as CropVolume (vtkExtractVOI) on the full volume
+        im.SetOrigin(volume.meta["origin"])
+        im.SetExtent(lower[2], upper[2] - 1, lower[1], upper[1] - 1, lower[0], upper[0] - 1)
+        reader = vtk.vtkImageChangeInformation()
+        reader.SetInputData(im)
+    elif os.path.isdir(input_path):
         print(f"Reading DICOM folder: {input_path}")
-        reader = vtk.vtkDICOMImageReader()
-        reader.SetDirectoryName(input_path)
+        # pass-through filter: same Update()/GetOutput() interface as the VTK readers, same
+        # voxels and geometry as the vtkDICOMImageReader used before
+        reader = vtk.vtkImageChangeInformation()
+        reader.SetInputData(SitkToVtk(read_series_parallel(input_path), dicom_order=True))
     else:
         ext = os.path.splitext(input_path)[1].lower()
         if ext == '.nii':
@@ -79,18 +510,69 @@ def get_reader(input_path):
             raise ValueError(f"Unsupported file format or path: {input_path}")
     return reader
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("Usage: python script.py <input_file_or_dicom_folder> [threshold] [selective_region]")
-        sys.exit(1)
+def base_name(input_path):
+    """Output name of an input volume: the DICOM folder or file name without extension."""
+    if os.path.isdir(input_path) and not is_store(input_path):
+        return os.path.basename(input_path.rstrip('/\\'))
+    return os.path.splitext(os.path.basename(input_path.rstrip('/\\')))[0]
 
-    input_path = sys.argv[1]
-    threshold = float(sys.argv[2]) if len(sys.argv) > 2 else 300.0
-    selective_region = bool(int(sys.argv[3])) if len(sys.argv) > 3 else False
+def extract_label_surfaces(label_image, names, output_dir=os.path.join("3D", "surface_output"), method="discrete_flying_edges",
+                           crop="auto", margin=CROP_MARGIN, multiblock_name=None,
+                           smoother="laplacian", smoothing_iterations=None, target_triangles=None, smoother_params=None,
+                           surface_format="stl"):
+    """
+    Surfaces of the labels of a label map in one pass (LabelSurfaces), post-processed like extract_surface.
+    names: {label: output name}, each surface is written to <name>_surface.<format extension>, or, with
+    multiblock_name, all of them to <multiblock_name>.vtm (one named block per label). Returns the written paths.
+    """
+    if crop == "auto":
+        label_image = AutoCrop(label_image, 1, margin)
+    surfaces = LabelSurfaces(label_image, sorted(names), method)
+    blocks = vtk.vtkMultiBlockDataSet()
+    written = []
+    for i, (label, surface) in enumerate(sorted(surfaces.items())):
+        print(f"Label {label} ({names[label]}):")
+        surface = PostProcess(surface, smoother, smoothing_iterations, target_triangles, release=True,
+                              **(smoother_params or {}))
+        if multiblock_name:
+            blocks.SetBlock(i, surface)
+            blocks.GetMetaData(i).Set(vtk.vtkCompositeDataSet.NAME(), names[label])
+            continue
+        output_file = os.path.join(output_dir, f"{names[label]}_surface{SURFACE_FORMATS[surface_format]}")
+        written.append(write_surface(surface, output_file, surface_format))
+        print(f"Surface written to {output_file}")
+    if multiblock_name:
+        output_file = os.path.join(output_dir, f"{multiblock_name}.vtm")
+        writer = vtk.vtkXMLMultiBlockDataWriter()
+        writer.SetInputData(blocks)
+        writer.SetFileName(output_file)
+        writer.Write()
+        written.append(output_file)
+        print(f"Multi-block surfaces written to {output_file}")
+    return written
 
-    reader = get_reader(input_path)
+def extract_surface(input_path, threshold=300.0, selective_region=False, output_dir=os.path.join("3D", "surface_output"),
+                    voi=None, crop="auto", margin=CROP_MARGIN, components=None, min_component_size=0,
+                    smoother="laplacian", smoothing_iterations=None, target_triangles=None, smoother_params=None,
+                    backend="marching_cubes", surface_format="stl"):
+    """
+    Read a volume, run marching cubes + smoothing on it and write the STL surface, returns its path.
+    voi (xmin, xmax, ymin, ymax, zmin, zmax) restricts the surface to a sub-volume.
+    crop: "auto" contours only the bounding box of the voxels >= threshold (plus margin voxels),
+    "components" each connected component in its own bounding box, None the whole volume.
+    components (ranks by decreasing size, [1] for the largest) and/or min_component_size select
+    the connected components on the voxels before contouring, instead of the connectivity filter
+    on the surface (selective_region is then ignored).
+    smoother (SMOOTHERS), smoothing_iterations, smoother_params and target_triangles (quadric
+    decimation after the smoothing) set the post-processing of the surface, see PostProcess.
+    backend: contouring algorithm (CONTOUR_BACKENDS), the output file name does not depend on it.
+    surface_format: output format (surface_io.SURFACE_FORMATS), binary STL by default.
+    """
+    reader = get_reader(input_path, voi)
     reader.Update()
     im = reader.GetOutput()
+    if voi and not is_store(input_path):
+        im = CropVolume(im, voi)
 
     print(im.GetPointData())
     scalars = im.GetPointData().GetScalars()
@@ -98,36 +580,98 @@ if __name__ == '__main__':
         raise RuntimeError("No scalar data found in the image!")
 
     print("Scalar range:", scalars.GetRange())
-    
-    #get last dir name from path
-    dir_name = input_path.split("/")[-1]
-    print(input_path.split("/"))
-    print(f"Directory name: {dir_name}")
-    
-    if "SagGRE2" in dir_name:
-        print("Cropping volume for Sag_GRE2")
-        #voi = (0, 80, 0, 127, 30, 110)
-        #with paraview ExtractSubset (VOI) filter
-        voi = (0, 250, 0, 253, 60, 245)
-        im = CropVolume(im, voi)
 
-    poly = MarchingCubes(im, threshold=threshold, selective_regions=selective_region)
-    if selective_region:
+    voxel_selection = bool(components or min_component_size)
+    if crop == "components":
+        poly = ComponentSurfaces(im, threshold, margin, components, min_component_size, backend)
+    else:
+        if crop == "auto":
+            im = AutoCrop(im, threshold, margin)
+        if voxel_selection:
+            im = SelectComponents(im, threshold, components, min_component_size)
+            if crop == "auto":
+                # without the noise islands, the box of the selected components is usually much smaller
+                im = AutoCrop(im, threshold, margin)
+        start = time.perf_counter()
+        poly = Contour(im, threshold, backend)
+        print(f"{backend}: {poly.GetNumberOfCells()} triangles in {time.perf_counter() - start:.2f}s")
+    if voxel_selection:
+        print(f"Surface of the selected components: {poly.GetNumberOfCells()} triangles")
+    else:
+        poly = KeepRegions(poly, selective_region)
+    if selective_region and not voxel_selection:
         num = CountRegions(poly)
         poly = ExtractRegion(poly, 1)
-    smoothed_poly = Smooth_stl(poly)
+    # only the surface is needed from here on: free the volume, then each mesh once the next one exists
+    del reader, im
+    poly = PostProcess(poly, smoother, smoothing_iterations, target_triangles, release=True, **(smoother_params or {}))
+
+    output_file = os.path.join(output_dir, f"{base_name(input_path)}_surface{SURFACE_FORMATS[surface_format]}")
+    write_surface(poly, output_file, surface_format)
+    print(f"Surface written to {output_file}")
+    return output_file
 
-    # Generate output filename from input path
-    if os.path.isdir(input_path):
-        base_name = os.path.basename(input_path.rstrip('/\\'))
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Marching cubes surface (STL) of a volume.")
+    parser.add_argument("input_path", help="Volume file (.vtk, .nii, .cvol) or DICOM folder.")
+    parser.add_argument("threshold", nargs="?", type=float, default=300.0)
+    parser.add_argument("selective_region", nargs="?", type=int, default=0, help="1: keep every region.")
+    parser.add_argument("--backend", choices=list(CONTOUR_BACKENDS), default="marching_cubes",
+                        help="Contouring algorithm (skimage needs scikit-image).")
+    parser.add_argument("--crop", choices=["auto", "components", "none"], default="auto",
+                        help="Contour the bounding box of the voxels above the threshold, of each component, or everything.")
+    parser.add_argument("--margin", type=int, default=CROP_MARGIN, help="Voxels kept around the bounding boxes.")
+    parser.add_argument("--components", type=int, nargs="+", default=None,
+                        help="Connected components of the voxels to contour, by decreasing size (1: the largest).")
+    parser.add_argument("--min-component-size", type=int, default=0, help="Drop the components of fewer voxels.")
+    parser.add_argument("--smoother", choices=list(SMOOTHERS), default="laplacian")
+    parser.add_argument("--smoothing-iterations", type=int, default=None, help="Default: per smoother constant.")
+    parser.add_argument("--pass-band", type=float, default=None, help="Windowed-sinc pass band (0-2, lower is smoother).")
+    parser.add_argument("--target-triangles", type=int, default=None, help="Quadric decimation after the smoothing.")
+    parser.add_argument("--threads", type=int, default=None, help="Threads of the VTK SMP filters (default: all cores).")
+    parser.add_argument("--format", choices=list(SURFACE_FORMATS), default="stl",
+                        help="Binary STL, ASCII STL, compressed VTP or quantized compact mesh (.npz).")
+    labels = parser.add_argument_group("multi-label extraction (one pass for every surface)")
+    labels.add_argument("--label-map", action="store_true", help="The input is a label map: one surface per label.")
+    labels.add_argument("--label-components", action="store_true",
+                        help="One surface per connected component (see --components and --min-component-size).")
+    labels.add_argument("--fuse", nargs="+", default=None, metavar="MASK",
+                        help="Masks on the grid of the input (e.g. registered volumes) fused with it into a label map.")
+    labels.add_argument("--label-method", choices=["discrete_flying_edges", "surface_nets"], default="discrete_flying_edges")
+    labels.add_argument("--multiblock", action="store_true", help="Write one .vtm file instead of one STL per label.")
+    args = parser.parse_args()
+    if args.pass_band is not None and args.smoother != "windowed_sinc":
+        parser.error("--pass-band needs --smoother windowed_sinc")
+
+    UseThreads(args.threads)
+    smoother_params = {"pass_band": args.pass_band} if args.pass_band is not None else None
+    output_dir = os.path.join("3D", "surface_output")
+
+    if args.label_map or args.label_components or args.fuse:
+        name = base_name(args.input_path)
+        if args.fuse:
+            paths = [args.input_path] + args.fuse
+            label_image = FuseMasks(paths, args.threshold)
+            names = {label: base_name(path) for label, path in enumerate(paths, 1)}
+            name = "fused"
+        else:
+            reader = get_reader(args.input_path)
+            reader.Update()
+            label_image = reader.GetOutput()
+            if args.label_components:
+                label_image = ComponentLabelMap(label_image, args.threshold, args.components, args.min_component_size)
+            label_array = ImageArray(label_image)
+            names = {int(label): f"{name}_label{label}" for label in np.unique(label_array[label_array > 0])}
+        extract_label_surfaces(label_image, names, output_dir, args.label_method,
+                               crop=None if args.crop == "none" else "auto", margin=args.margin,
+                               multiblock_name=f"{name}_surfaces" if args.multiblock else None,
+                               smoother=args.smoother, smoothing_iterations=args.smoothing_iterations,
+                               target_triangles=args.target_triangles, smoother_params=smoother_params,
+                               surface_format=args.format)
     else:
-        base_name = os.path.splitext(os.path.basename(input_path))[0]
-    
-    output_file = os.path.join("3D", "surface_output", f"{base_name}_surface.stl")
-    
-    writer = vtk.vtkSTLWriter()
-    writer.SetInputData(smoothed_poly)
-    writer.SetFileName(output_file)
-    writer.Write()
-
-    print(f"STL surface written to {output_file}")
+        extract_surface(args.input_path, args.threshold, bool(args.selective_region), output_dir,
+                        crop=None if args.crop == "none" else args.crop, margin=args.margin,
+                        components=args.components, min_component_size=args.min_component_size,
+                        smoother=args.smoother, smoothing_iterations=args.smoothing_iterations,
+                        target_triangles=args.target_triangles, smoother_params=smoother_params, backend=args.backend,
+                        surface_format=args.format)
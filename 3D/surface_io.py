@@ -0,0 +1,104 @@
+import argparse
+import os
+import time
+import numpy as np
+import pyvista as pv
+import vtk
+from vtk.util import numpy_support
+
+# surface format -> file extension
+SURFACE_FORMATS = {
+    "stl": ".stl",          # binary STL
+    "stl_ascii": ".stl",
+    "vtp": ".vtp",          # VTK XML polydata, zlib compressed
+    "npz": ".npz",          # quantized compact mesh (write_compact)
+}
+QUANTIZATION_BITS = 16
+
+def _geometry(polydata):
+    """
+    Triangles of a surface without its point and cell arrays (normals are stale after smoothing)
+    nor the points no triangle uses (the connectivity filter keeps those of the dropped regions).
+    """
+    if polydata.GetNumberOfStrips() or polydata.GetPolys().IsHomogeneous() != 3:
+        triangulate = vtk.vtkTriangleFilter()
+        triangulate.SetInputData(polydata)
+        triangulate.Update()
+        polydata = triangulate.GetOutput()
+    surface = vtk.vtkPolyData()
+    surface.SetPoints(polydata.GetPoints())
+    surface.SetPolys(polydata.GetPolys())
+    clean = vtk.vtkCleanPolyData()
+    clean.SetInputData(surface)
+    clean.PointMergingOff()
+    clean.Update()
+    return clean.GetOutput()
+
+def write_compact(polydata, path, bits=QUANTIZATION_BITS):
+    """
+    Quantized mesh (Draco-like, .npz): the points are snapped to a 2^bits grid over their bounding box
+    (error below half a grid step, 1 micron for a 15 cm tree with 16 bits) and the triangle indices
+    are delta coded, which makes them very compressible since marching cubes emits neighbouring points together.
+    """
+    surface = _geometry(polydata)
+    points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData()).astype(np.float64)
+    triangles = numpy_support.vtk_to_numpy(surface.GetPolys().GetConnectivityArray()).astype(np.int64)
+    origin = points.min(axis=0)
+    step = (points.max(axis=0) - origin) / (2 ** bits - 1)
+    step[step == 0] = 1
+    positions = np.rint((points - origin) / step).astype(np.uint16 if bits <= 16 else np.uint32)
+    np.savez_compressed(path, positions=positions, origin=origin, step=step,
+                        deltas=np.diff(triangles, prepend=0).astype(np.int32))
+
+def read_compact(path):
+    with np.load(path) as data:
+        points = data["positions"] * data["step"] + data["origin"]
+        triangles = np.cumsum(data["deltas"], dtype=np.int64).reshape(-1, 3)
+    return pv.PolyData.from_regular_faces(points.astype(np.float32), triangles)
+
+def write_surface(polydata, path, surface_format="stl"):
+    """Write a surface in one of SURFACE_FORMATS, returns path."""
+    if surface_format == "npz":
+        write_compact(polydata, path)
+        return path
+    if surface_format == "vtp":
+        writer = vtk.vtkXMLPolyDataWriter()
+        writer.SetDataModeToAppended()
+        writer.EncodeAppendedDataOff()  # raw binary instead of base64
+        writer.SetCompressorTypeToZLib()
+        polydata = _geometry(polydata)
+    else:
+        writer = vtk.vtkSTLWriter()
+        if surface_format == "stl_ascii":
+            writer.SetFileTypeToASCII()
+        else:
+            writer.SetFileTypeToBinary()
+    writer.SetInputData(polydata)
+    writer.SetFileName(path)
+    writer.Write()
+    return path
+
+def read_surface(path):
+    """pyvista.PolyData of a surface written by write_surface (or any file pv.read supports), used by flux/apply_mask.py."""
+    return read_compact(path) if path.endswith(".npz") else pv.read(path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert surfaces (.stl, .vtp, .npz) and compare size and load time.")
+    parser.add_argument("inputs", nargs="+")
+    parser.add_argument("--format", choices=list(SURFACE_FORMATS), default="npz")
+    parser.add_argument("--output-dir", default=None, help="Default: next to each input.")
+    args = parser.parse_args()
+
+    for input_path in args.inputs:
+        start = time.perf_counter()
+        surface = read_surface(input_path)
+        load_time = time.perf_counter() - start
+        name = os.path.splitext(os.path.basename(input_path))[0] + SURFACE_FORMATS[args.format]
+        output_path = os.path.join(args.output_dir or os.path.dirname(input_path), name)
+        if os.path.abspath(output_path) == os.path.abspath(input_path):
+            raise ValueError(f"{input_path} would be overwritten, use --output-dir")
+        write_surface(surface, output_path, args.format)
+        start = time.perf_counter()
+        read_surface(output_path)
+        print(f"{input_path}: {os.path.getsize(input_path) / 1e6:.2f} MB, loaded in {load_time:.3f}s -> "
+              f"{output_path}: {os.path.getsize(output_path) / 1e6:.2f} MB, loaded in {time.perf_counter() - start:.3f}s")
@@ -1,9 +1,14 @@
 import tkinter as tk
 from tkinter import filedialog, Listbox, Label, Scrollbar
 import os
+import sys
 import SimpleITK as sitk
 import subprocess
 
+# catalog of the DICOM series (image_filtering/dicom_index.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image_filtering"))
+from dicom_index import series_files
+
 class FileExplorerApp:
     def __init__(self, root, fiji_path):
         self.root = root
@@ -50,7 +55,7 @@ class FileExplorerApp:
         if not os.path.exists(temp_image_path):
             print("Création du fichier temporaire")
             reader = sitk.ImageSeriesReader()
-            dicom_series = reader.GetGDCMSeriesFileNames(dicom_dir)
+            dicom_series = series_files(dicom_dir)
             reader.SetFileNames(dicom_series)
             
             # Lecture de la série d'images en un volume 3D
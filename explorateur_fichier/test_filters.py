@@ -2,12 +2,17 @@ import tkinter as tk
 from tkinter import filedialog, Listbox, Scrollbar, MULTIPLE
 from tkinter import ttk
 import os
+import sys
 import SimpleITK as sitk
 import subprocess
 from ttkthemes import ThemedTk
 import tkinter.messagebox as messagebox
 from PIL import Image, ImageTk
 
+# catalog of the DICOM series (image_filtering/dicom_index.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image_filtering"))
+from dicom_index import series_files
+
 class FileExplorerApp:
     def __init__(self, root):
         self.root = root
@@ -75,7 +80,7 @@ class FileExplorerApp:
         """
         
         reader = sitk.ImageSeriesReader()
-        dicom_series = reader.GetGDCMSeriesFileNames(dicom_dir)
+        dicom_series = series_files(dicom_dir)
         reader.SetFileNames(dicom_series)
 
         # Lecture de la série d'images en un volume 3D
@@ -1,25 +1,39 @@
+import os
+import sys
 import pyvista as pv
 import numpy as np
 
-# Step 1: Load the binary mask and Sag_Flux
-mask = pv.read("image_filtering/filtered_dicom/Sag_GRE.vtk_output.vtk")
-flux = pv.read("VTK_Files/Sag_Flux.vtk")
+# memory-mapped .mhd/.raw volumes (image_filtering/raw_volume.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image_filtering"))
+from raw_volume import open_volume
+# surfaces written by 3D/marching_cubes.py (.stl, .vtp or quantized .npz)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "3D"))
+from surface_io import read_surface
+
+# Step 1: Load the binary mask and Sag_Flux (.mhd volumes are memory-mapped instead of read)
+mask = open_volume(sys.argv[1] if len(sys.argv) > 1 else "image_filtering/filtered_dicom/Sag_GRE.vtk_output.vtk")
+flux = open_volume(sys.argv[2] if len(sys.argv) > 2 else "VTK_Files/Sag_Flux.vtk")
 
 # Step 2: Check matching dimensions
 if mask.dimensions != flux.dimensions:
     raise ValueError("Mask and Sag_Flux dimensions do not match!")
 
 # Step 3: Convert mask to boolean
-print(set(mask.point_data["scalars"])) #confirm mask values
+scalars = mask.point_data["scalars"]
+print(np.unique(scalars[::max(1, scalars.size // 100000)])) #confirm mask values (on a sample of the voxels)
 print("Mask point data:", mask.point_data)
 print("Flux point data:", flux.point_data)
-binary_mask = mask.point_data["scalars"] > 0  # Assumes scalar mask with values 0 or 255
+binary_mask = scalars > 0  # Assumes scalar mask with values 0 or 255
 
 print("Visualizing original mask...")
-segmented = mask.threshold(value=1, invert=False)
+if len(sys.argv) > 3:
+    # surface already extracted by marching_cubes.py, much faster to load than to recompute
+    surface = read_surface(sys.argv[3])
+else:
+    segmented = mask.threshold(value=1, invert=False)
 
-# Extract the surface from the thresholded volume
-surface = segmented.extract_surface()
+    # Extract the surface from the thresholded volume
+    surface = segmented.extract_surface()
 
 # Plot the 3D surface
 plotter = pv.Plotter()
@@ -37,11 +51,12 @@ flux_glyphs.plot(
 """
 # Apply scalar mask to vector field
 vectors = flux.point_data["vectors"]
-masked_vectors = np.where(binary_mask[:, None], vectors, 0)
+masked_vectors = np.empty(vectors.shape, dtype=vectors.dtype)  # the only full size copy of the field
+np.multiply(vectors, binary_mask[:, None], out=masked_vectors)
 flux.point_data["masked_vectors"] = masked_vectors
 
-# Compute magnitude of masked vectors
-masked_magnitude = np.linalg.norm(masked_vectors, axis=1)
+# Compute magnitude of masked vectors (einsum: no (n, 3) temporary)
+masked_magnitude = np.sqrt(np.einsum("ij,ij->i", masked_vectors, masked_vectors))
 flux.point_data["masked_magnitude"] = masked_magnitude
 
 # Visualize masked vector field
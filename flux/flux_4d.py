@@ -0,0 +1,128 @@
+import argparse
+import csv
+import glob
+import os
+import re
+import sys
+import numpy as np
+import pyvista as pv
+
+from interpolation import interpolation_operator
+from metrics import velocity_errors, summarize_errors
+
+# memory-mapped .mhd/.raw volumes (image_filtering/raw_volume.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image_filtering"))
+from raw_volume import open_volume
+
+def natural_key(path):
+    """Sort phase_2 before phase_10."""
+    return [int(t) if t.isdigit() else t for t in re.split(r"(\d+)", path)]
+
+def phase_files(source):
+    # the <phase>.<array>.mhd files are extra arrays of a phase, loaded with it
+    return sorted((f for f in glob.glob(source) if not f.endswith(".mhd") or os.path.basename(f).count(".") == 1),
+                  key=natural_key)
+
+def pvd_reader(source):
+    """Reader of a .pvd time series, with at least one time step."""
+    try:
+        reader = pv.get_reader(source)
+    except IndexError:  # pyvista fails on an empty collection
+        reader = None
+    if reader is None or not reader.time_values:
+        raise ValueError(f"No time step in {source}")
+    return reader
+
+def iter_phases(source):
+    """
+    Yield (phase, mesh) one cardiac phase at a time, so only the current phase is in memory.
+    source is either a glob pattern of phase files (Sag_Flux_*.vtk, or memory-mapped Sag_Flux_*.mhd)
+    or a .pvd time series.
+    """
+    if source.endswith(".pvd"):
+        reader = pvd_reader(source)
+        for phase in range(len(reader.time_values)):
+            reader.set_active_time_point(phase)
+            mesh = reader.read()
+            if isinstance(mesh, pv.MultiBlock):
+                mesh = mesh[0] if mesh.n_blocks == 1 else mesh.combine()
+            yield phase, mesh
+        return
+
+    files = phase_files(source)
+    if not files:
+        raise FileNotFoundError(f"No phase file matches {source}")
+    for phase, path in enumerate(files):
+        yield phase, open_volume(path)
+
+def count_phases(source):
+    if source.endswith(".pvd"):
+        return len(pvd_reader(source).time_values)
+    return len(phase_files(source))
+
+def stream_flux_errors(flux_source, stokes_source, mask_path, operator_path=None):
+    """
+    Mask each Sag_Flux phase, interpolate the matching Stokes phase on the masked points and yield
+    (phase, mean errors). The mask indices and the interpolation weights are computed on the first
+    phase and reused for the following ones (the geometry does not change between phases).
+    """
+    mask = open_volume(mask_path)
+    mask_ids = np.flatnonzero(mask.point_data["scalars"] > 0)  # Assumes scalar mask with values 0 or 255
+
+    n_stokes = count_phases(stokes_source)
+    n_flux = count_phases(flux_source)
+    if n_stokes not in (1, n_flux):
+        raise ValueError(f"{n_stokes} Stokes phases for {n_flux} Sag_Flux phases.")
+    # steady simulation: the same Stokes field is compared to every phase
+    stokes_phases = iter_phases(stokes_source)
+    _, stokes = next(stokes_phases)
+
+    operator = None
+    for phase, flux in iter_phases(flux_source):
+        if flux.n_points != mask.n_points:
+            raise ValueError("Mask and Sag_Flux dimensions do not match!")
+        if phase > 0 and n_stokes > 1:
+            _, stokes = next(stokes_phases)
+        if operator is None:
+            operator = interpolation_operator(stokes.points, flux.points[mask_ids], operator_path)
+
+        flux_vectors = flux.point_data["vectors"][mask_ids]
+        stokes_vectors = operator @ stokes.point_data["Velocity"]
+        yield phase, summarize_errors(velocity_errors(stokes_vectors, flux_vectors))
+
+def write_metrics(rows, output_path):
+    names = ["l2", "magnitude", "angular_deg"]
+    with open(output_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["phase"] + names)
+        for phase, metrics in rows:
+            writer.writerow([phase] + [f"{metrics[n]:.6f}" for n in names])
+    print(f"Saved per-phase metrics to {output_path}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Phase by phase comparison of 4D Sag_Flux with Stokes.")
+    parser.add_argument("--flux", required=True, help="Glob of the Sag_Flux phase files or a .pvd series.")
+    parser.add_argument("--stokes", required=True, help="Glob of the Stokes phase files, a .pvd series or a single (steady) file.")
+    parser.add_argument("--mask", default="image_filtering/filtered_dicom/Sag_GRE.vtk_output.vtk", help="Binary mask on the Sag_Flux grid.")
+    parser.add_argument("--operator", default="VTK_Files/Stokes_to_Sag_Flux_4d_operator.npz", help="Saved interpolation operator.")
+    parser.add_argument("--output", default="VTK_Files/flux_4d_metrics.csv", help="CSV of the per-phase and time-averaged errors.")
+    args = parser.parse_args()
+
+    rows = []
+    totals = {}
+    for phase, metrics in stream_flux_errors(args.flux, args.stokes, args.mask, args.operator):
+        print(f"Phase {phase}: L2 {metrics['l2']:.3f}, magnitude {metrics['magnitude']:.3f}, "
+              f"angle {metrics['angular_deg']:.2f}°")
+        rows.append((phase, metrics))
+        for name, value in metrics.items():
+            totals[name] = totals.get(name, 0.0) + value
+
+    time_averaged = {name: value / len(rows) for name, value in totals.items()}
+    print(f"Time-averaged: L2 {time_averaged['l2']:.3f}, magnitude {time_averaged['magnitude']:.3f}, "
+          f"angle {time_averaged['angular_deg']:.2f}°")
+    rows.append(("mean", time_averaged))
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    write_metrics(rows, args.output)
+
+if __name__ == "__main__":
+    main()
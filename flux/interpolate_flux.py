@@ -1,7 +1,10 @@
 import pyvista as pv
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.interpolate import griddata
+from interpolation import interpolation_operator
+
+# Saved Stokes -> Sag_Flux operator, rebuilt automatically if either mesh changes
+OPERATOR_PATH = "VTK_Files/Stokes_to_Sag_Flux_operator.npz"
 
 #stokes = pv.read("VTK_Files/Interpolated_Stokes_on_Sag_Flux.vtu")
 stokes = pv.read("VTK_Files/Stokes_recale.vtu")
@@ -28,15 +31,16 @@ coords_tgt = flux.points
 print(coords_src)
 print(coords_tgt)
 
+# Linear interpolation operator (triangulation done once, cached on disk)
+operator = interpolation_operator(coords_src, coords_tgt, OPERATOR_PATH)
+
 # Interpolate Velocity (vector field)
 velocity_src = stokes.point_data["Velocity"]
-velocity_interp = np.zeros_like(coords_tgt)
-for i in range(3):
-    velocity_interp[:, i] = griddata(coords_src, velocity_src[:, i], coords_tgt, method='linear', fill_value=0)
+velocity_interp = operator @ velocity_src
 
 # Interpolate Pressure (scalar field)
 pressure_src = stokes.point_data["Pressure"]
-pressure_interp = griddata(coords_src, pressure_src, coords_tgt, method='linear', fill_value=0)
+pressure_interp = operator @ pressure_src
 
 # Clone the flux mesh geometry but create a new mesh for interpolated fields
 interpolated_stokes = pv.PolyData(coords_tgt)
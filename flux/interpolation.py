@@ -0,0 +1,64 @@
+import hashlib
+import os
+import numpy as np
+from scipy.spatial import Delaunay
+from scipy import sparse
+
+def coords_fingerprint(coords):
+    """Hash of a point cloud, used to check that a saved operator matches the current meshes."""
+    coords = np.ascontiguousarray(coords, dtype=np.float64)
+    return hashlib.sha1(coords.tobytes() + str(coords.shape).encode()).hexdigest()
+
+def build_interpolation_matrix(coords_src, coords_tgt):
+    """
+    Linear (barycentric) interpolation from the source points onto the target points as a sparse
+    (n_tgt, n_src) matrix: same result as griddata(method='linear', fill_value=0) but the Delaunay
+    triangulation is only built once and every field is then a single mat-vec.
+    Target points outside the convex hull of the source get an empty row (value 0).
+    """
+    coords_src = np.asarray(coords_src, dtype=np.float64)
+    coords_tgt = np.asarray(coords_tgt, dtype=np.float64)
+    ndim = coords_src.shape[1]
+
+    tri = Delaunay(coords_src)
+    simplex = tri.find_simplex(coords_tgt)
+    inside = np.flatnonzero(simplex >= 0)
+
+    # barycentric coordinates of the points inside the hull
+    T = tri.transform[simplex[inside]]                    # (m, ndim+1, ndim)
+    b = np.einsum("ijk,ik->ij", T[:, :ndim], coords_tgt[inside] - T[:, ndim])
+    weights = np.column_stack([b, 1.0 - b.sum(axis=1)])  # (m, ndim+1)
+    vertices = tri.simplices[simplex[inside]]             # (m, ndim+1)
+
+    rows = np.repeat(inside, ndim + 1)
+    return sparse.csr_matrix((weights.ravel(), (rows, vertices.ravel())),
+                             shape=(len(coords_tgt), len(coords_src)))
+
+def save_operator(path, matrix, coords_src, coords_tgt):
+    """Save the operator with the fingerprints of the meshes it was built for."""
+    matrix = matrix.tocsr()
+    np.savez_compressed(path, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+                        shape=np.array(matrix.shape),
+                        src=coords_fingerprint(coords_src), tgt=coords_fingerprint(coords_tgt))
+
+def load_operator(path, coords_src=None, coords_tgt=None):
+    """Load a saved operator, returns None if it was built for other meshes than the given ones."""
+    with np.load(path) as f:
+        if coords_src is not None and str(f["src"]) != coords_fingerprint(coords_src):
+            return None
+        if coords_tgt is not None and str(f["tgt"]) != coords_fingerprint(coords_tgt):
+            return None
+        return sparse.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"]))
+
+def interpolation_operator(coords_src, coords_tgt, cache_path=None):
+    """Load the operator from cache_path when it matches the meshes, else build it (and save it)."""
+    if cache_path is not None and os.path.exists(cache_path):
+        operator = load_operator(cache_path, coords_src, coords_tgt)
+        if operator is not None:
+            print(f"Loaded interpolation operator from {cache_path}")
+            return operator
+    operator = build_interpolation_matrix(coords_src, coords_tgt)
+    if cache_path is not None:
+        save_operator(cache_path, operator, coords_src, coords_tgt)
+        print(f"Saved interpolation operator to {cache_path}")
+    return operator
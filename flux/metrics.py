@@ -0,0 +1,24 @@
+import numpy as np
+
+def velocity_errors(stokes_vectors, sag_flux_vectors):
+    """Per-point errors between two (N, 3) velocity fields: L2, magnitude and angle (degrees)."""
+    norm_stokes = np.linalg.norm(stokes_vectors, axis=1)
+    norm_sag_flux = np.linalg.norm(sag_flux_vectors, axis=1)
+
+    # Erreur composante par composante (L2)
+    diff_l2 = np.linalg.norm(stokes_vectors - sag_flux_vectors, axis=1)
+
+    # Erreur sur la magnitude
+    diff_magnitude = np.abs(norm_stokes - norm_sag_flux)
+
+    # Erreur angulaire
+    dot_product = np.einsum('ij,ij->i', stokes_vectors, sag_flux_vectors)
+    denominator = norm_stokes * norm_sag_flux
+    cos_theta = np.clip(dot_product / (denominator + 1e-8), -1.0, 1.0)
+    angular_error_deg = np.degrees(np.arccos(cos_theta))
+
+    return {"l2": diff_l2, "magnitude": diff_magnitude, "angular_deg": angular_error_deg}
+
+def summarize_errors(errors):
+    """Mean of each error array."""
+    return {name: float(np.mean(values)) for name, values in errors.items()}
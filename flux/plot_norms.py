@@ -1,6 +1,7 @@
 import pyvista as pv
 import numpy as np
 import matplotlib.pyplot as plt
+from metrics import velocity_errors
 
 #stokes = pv.read("VTK_Files/Stokes_recale.vtu")
 stokes = pv.read("VTK_Files/Interpolated_Stokes_on_Sag_Flux.vtu")
@@ -87,18 +88,11 @@ plt.tight_layout()
 plt.savefig("img/Norms_Stokes_Sag_Flux_normalized.png")
 plt.show()
 
-# Erreur composante par composante (L2)
-diff_l2 = np.linalg.norm(stokes_vectors - sag_flux_vectors, axis=1)
-
-# Erreur sur la magnitude
-diff_magnitude = np.abs(norm_stokes - norm_sag_flux)
-
-# Erreur angulaire
-dot_product = np.einsum('ij,ij->i', stokes_vectors, sag_flux_vectors)
-denominator = norm_stokes * norm_sag_flux
-cos_theta = np.clip(dot_product / (denominator + 1e-8), -1.0, 1.0)
-angular_error = np.arccos(cos_theta)  # radians
-angular_error_deg = np.degrees(angular_error)
+# Erreurs L2, sur la magnitude et angulaire
+errors = velocity_errors(stokes_vectors, sag_flux_vectors)
+diff_l2 = errors["l2"]
+diff_magnitude = errors["magnitude"]
+angular_error_deg = errors["angular_deg"]
 
 # Statistiques
 print(f"Moy. erreur L2 : {np.mean(diff_l2):.3f}")
@@ -0,0 +1,181 @@
+import argparse
+import csv
+import json
+import os
+import resource
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.ndimage import uniform_filter
+from imageio.v2 import imread
+import SimpleITK as sitk
+
+from dicom_loader import read_series_array
+from filters import DENOISERS, add_noise, item_rng, parameter_grid
+
+# noise model -> parameter grid (intensities in 8-bit units), denoiser -> parameter grid
+DEFAULT_GRID = {
+    "noise": {
+        "gaussian": {"scale": [10, 25]},
+        "rician": {"v": [8], "s": [5, 10]},
+        "salt_and_pepper": {"p": [0.02], "q": [0.02]},
+    },
+    "denoisers": {
+        "gaussian": {"sigma": [0.5, 1.0, 2.0]},
+        "median": {"size": [3, 5]},
+        "non_local_means": {"patch_radius": [1], "search_radius": [3], "h_factor": [0.7, 1.0]},
+        "curvature_diffusion": {"iterations": [5]},
+        "bilateral": {"domain_sigma": [1.0], "range_sigma": [50.0]},
+    },
+}
+
+# noise parameters given in 8-bit units, scaled by data_range / 255 so that images and volumes get the same SNR
+INTENSITY_PARAMS = {"gaussian": ("scale",), "rician": ("v", "s")}
+
+def scaled_noise_params(model, noise_params, data_range):
+    """Noise parameters of the grid expressed for an image of this data range (salt is data_range)."""
+    params = {k: v * data_range / 255 if k in INTENSITY_PARAMS.get(model, ()) else v for k, v in noise_params.items()}
+    if model == "salt_and_pepper":
+        params.setdefault("high", data_range)
+    return params
+
+def psnr(reference, image, data_range):
+    mse = np.mean((reference.astype(np.float64) - image) ** 2)
+    return float("inf") if mse == 0 else float(10 * np.log10(data_range ** 2 / mse))
+
+def ssim(reference, image, data_range, window=7):
+    """Mean SSIM (Wang et al. 2004) with a uniform window, in 2D or 3D."""
+    x = reference.astype(np.float64)
+    y = image.astype(np.float64)
+    c1, c2 = (0.01 * data_range) ** 2, (0.03 * data_range) ** 2
+    n = window ** x.ndim
+    # sample (co)variances like skimage.metrics.structural_similarity
+    mean = lambda a: uniform_filter(a, window)
+    mx, my = mean(x), mean(y)
+    vx = (mean(x * x) - mx * mx) * n / (n - 1)
+    vy = (mean(y * y) - my * my) * n / (n - 1)
+    cxy = (mean(x * y) - mx * my) * n / (n - 1)
+    s = ((2 * mx * my + c1) * (2 * cxy + c2)) / ((mx * mx + my * my + c1) * (vx + vy + c2))
+    # ignore the borders where the window is truncated
+    pad = (window - 1) // 2
+    return float(s[(slice(pad, -pad),) * x.ndim].mean())
+
+def load_reference(path, max_slices=None):
+    """Clean float32 image (grayscale) or volume (DICOM series folder) and its data range."""
+    if os.path.isdir(path):
+        volume = read_series_array(path)[0]
+        if max_slices and len(volume) > max_slices:
+            start = (len(volume) - max_slices) // 2
+            volume = volume[start:start + max_slices]
+        return volume.astype(np.float32), float(volume.max())
+    image = imread(path)
+    if image.ndim == 3:
+        image = image[..., :3].mean(axis=2)
+    return image.astype(np.float32), 255.0
+
+def measure(func, *args, **kwargs):
+    """
+    (result, wall time in s, peak of the Python/NumPy allocations in MB) of a call. The time is
+    measured on a first run, the peak on a second one under tracemalloc (which slows the Python side
+    allocations down). Memory allocated by SimpleITK/VTK is not traced: the rows also give the peak
+    RSS of the worker process so far.
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def run_case(task):
+    """All the denoiser configurations on one (input, noise configuration): returns the result rows."""
+    path, model, noise_params, key, seed, denoisers, max_slices, threads = task
+    # the cores are shared between the pool workers: ITK filters and non local means tiles
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(threads)
+    reference, data_range = load_reference(path, max_slices)
+    noisy = add_noise(reference, model, item_rng(seed, *key), clip=(0, data_range),
+                      **scaled_noise_params(model, noise_params, data_range))
+    base = {
+        "input": path,
+        "shape": "x".join(str(s) for s in reference.shape),
+        "noise": model,
+        "noise_params": json.dumps(noise_params),
+        "noisy_psnr": psnr(reference, noisy, data_range),
+        "noisy_ssim": ssim(reference, noisy, data_range),
+    }
+    rows = []
+    for name, grid in denoisers.items():
+        for params in parameter_grid(grid):
+            call_params = {"workers": threads, **params} if name == "non_local_means" else params
+            denoised, elapsed, peak = measure(DENOISERS[name], noisy, **call_params)
+            rows.append({**base, "denoiser": name, "denoiser_params": json.dumps(params),
+                         "psnr": psnr(reference, denoised, data_range),
+                         "ssim": ssim(reference, denoised, data_range),
+                         "threads": threads, "time_s": elapsed, "peak_mb": peak,
+                         "worker_peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024})
+    print(f"{path} {model} {noise_params}: {len(rows)} configurations")
+    return rows
+
+def run_benchmark(inputs, grid=DEFAULT_GRID, seed=0, workers=None, max_slices=None):
+    """
+    Noise model x denoiser x parameter grid over the inputs, one process task per (input, noise).
+    Each worker gets an equal share of the cores for its multi-threaded denoisers.
+    """
+    tasks = []
+    for i, path in enumerate(inputs):
+        for model, noise_grid in grid["noise"].items():
+            for j, noise_params in enumerate(parameter_grid(noise_grid)):
+                tasks.append((path, model, noise_params, (i, sorted(grid["noise"]).index(model), j), seed,
+                              grid["denoisers"], max_slices))
+    cores = os.cpu_count() or 1
+    workers = min(workers or cores, len(tasks)) or 1
+    tasks = [task + (max(1, cores // workers),) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [row for rows in pool.map(run_case, tasks) for row in rows]
+
+def write_results(rows, output_path):
+    """CSV or JSON according to the extension."""
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    if output_path.endswith(".json"):
+        with open(output_path, "w") as f:
+            json.dump(rows, f, indent=1)
+    else:
+        with open(output_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    print(f"Saved {len(rows)} results to {output_path}")
+
+def print_best(rows):
+    """Best denoiser configuration (SSIM) for each input and noise configuration."""
+    best = {}
+    for row in rows:
+        key = (row["input"], row["noise"], row["noise_params"])
+        if key not in best or row["ssim"] > best[key]["ssim"]:
+            best[key] = row
+    for (path, model, noise_params), row in sorted(best.items()):
+        print(f"{path} {model} {noise_params}: {row['denoiser']} {row['denoiser_params']} "
+              f"SSIM {row['noisy_ssim']:.3f} -> {row['ssim']:.3f}, PSNR {row['noisy_psnr']:.1f} -> {row['psnr']:.1f} dB, "
+              f"{row['time_s']:.3f} s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the denoisers of filters.py on noisy images and volumes.")
+    parser.add_argument("inputs", nargs="+", help="2D image files and/or DICOM series folders.")
+    parser.add_argument("--grid", default=None, help="JSON file with the noise and denoiser grids (default: DEFAULT_GRID).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-slices", type=int, default=None, help="Central slices kept of each volume.")
+    parser.add_argument("--output", nargs="+", default=["image_filtering/benchmark/denoise.csv"], help=".csv and/or .json")
+    args = parser.parse_args()
+
+    grid = DEFAULT_GRID
+    if args.grid:
+        with open(args.grid) as f:
+            grid = json.load(f)
+    rows = run_benchmark(args.inputs, grid, args.seed, args.workers, args.max_slices)
+    for output_path in args.output:
+        write_results(rows, output_path)
+    print_best(rows)
@@ -0,0 +1,115 @@
+import itertools
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import SimpleITK as sitk
+from scipy.ndimage import uniform_filter
+
+def estimate_noise_sigma(array):
+    """Robust Gaussian noise level: median absolute deviation of the differences along the last axis."""
+    diff = np.diff(array.astype(np.float32), axis=-1).ravel() / np.sqrt(2)
+    return float(1.4826 * np.median(np.abs(diff - np.median(diff))))
+
+def nlm(array, patch_radius=1, search_radius=3, h=None, h_factor=1.0, sigma=None):
+    """
+    Non-local means (Buades et al.) of a 2D image or 3D volume, vectorized over the voxels: for each
+    offset d of the search window, the patch distances of all the voxels are a box filter of the squared
+    difference with the shifted image. The distance map of d also gives the one of -d shifted by d,
+    so only half of the offsets are computed. Weights are exp(-max(D - 2 sigma^2, 0) / h^2), D being
+    the mean squared patch difference and h = h_factor * sigma (sigma estimated when not given).
+    The borders are reflected, so a tile with a halo of patch_radius + search_radius gives the same
+    values as the whole volume.
+    """
+    u = array.astype(np.float32)
+    sigma = estimate_noise_sigma(u) if sigma is None else sigma
+    h = h if h is not None else max(h_factor * sigma, 1e-6)
+    p, s = patch_radius, search_radius
+    pad = 2 * s + p
+    padded = np.pad(u, pad, mode="reflect")
+    shape = u.shape
+
+    def region(start, offset=(0,) * u.ndim, extra=0):
+        # voxels x + offset for x in [start, n - start + extra) along each axis, in padded
+        return tuple(slice(pad + start + o, pad + n - start + extra + o) for n, o in zip(shape, offset))
+
+    # distances are computed for x in [-s, n + s) so that D_d(x - d) is available for the offset -d
+    centre = padded[region(-s - p)]
+    inner = tuple(slice(p, p + n + 2 * s) for n in shape)
+    num = u.copy()  # offset 0: weight 1
+    den = np.ones(shape, dtype=np.float32)
+    diff = np.empty(centre.shape, dtype=np.float32)
+    for offset in itertools.product(range(-s, s + 1), repeat=u.ndim):
+        if offset <= (0,) * u.ndim:
+            continue  # zero offset above, negative ones with their opposite
+        np.subtract(centre, padded[region(-s - p, offset)], out=diff)
+        np.square(diff, out=diff)
+        weights = uniform_filter(diff, 2 * p + 1, mode="constant")[inner]
+        weights -= 2 * sigma ** 2
+        np.maximum(weights, 0, out=weights)
+        weights *= -1.0 / h ** 2
+        np.exp(weights, out=weights)
+        # +d: weight at x, neighbour x + d
+        forward = weights[tuple(slice(s, s + n) for n in shape)]
+        den += forward
+        num += forward * padded[region(0, offset)]
+        # -d: weight D_d(x - d), neighbour x - d
+        backward = weights[tuple(slice(s - o, s - o + n) for n, o in zip(shape, offset))]
+        den += backward
+        num += backward * padded[region(0, tuple(-o for o in offset))]
+    return num / den
+
+def tiled(func, array, halo, tile_size=32, workers=None, **params):
+    """
+    Run func(tile, **params) on overlapping tiles along the first axis in a thread pool (the NumPy
+    work releases the GIL) and assemble the cores of the tiles into a preallocated result.
+    """
+    n = array.shape[0]
+    out = None
+    starts = list(range(0, n, tile_size))
+
+    def run(z0):
+        z1 = min(n, z0 + tile_size)
+        lo, hi = max(0, z0 - halo), min(n, z1 + halo)
+        return z0, z1, func(array[lo:hi], **params)[z0 - lo:z1 - lo]
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for z0, z1, core in pool.map(run, starts):
+            if out is None:
+                out = np.empty(array.shape, dtype=core.dtype)
+            out[z0:z1] = core
+    return out
+
+def nlm_tiled(array, patch_radius=1, search_radius=3, h=None, h_factor=1.0, sigma=None, tile_size=32, workers=None):
+    """Tiled parallel nlm; sigma is estimated once on the whole array so that every tile uses the same h."""
+    sigma = estimate_noise_sigma(array) if sigma is None else sigma
+    return tiled(nlm, array, patch_radius + search_radius, tile_size, workers,
+                 patch_radius=patch_radius, search_radius=search_radius, h=h, h_factor=h_factor, sigma=sigma)
+
+def non_local_means(image, patch_radius=1, search_radius=3, h=None, h_factor=1.0, sigma=None, tile_size=32):
+    """Profile filter: tiled non-local means of a SimpleITK image (float32 result)."""
+    result = sitk.GetImageFromArray(nlm_tiled(sitk.GetArrayViewFromImage(image), patch_radius, search_radius,
+                                              h, h_factor, sigma, tile_size))
+    result.CopyInformation(image)
+    return result
+
+def curvature_diffusion(image, iterations=5, time_step=None, conductance=3.0):
+    """Profile filter: curvature anisotropic diffusion (edge preserving), multi-threaded by ITK."""
+    # stable time step: below 1 / 2^(dimension + 1) in spacing units
+    time_step = time_step or min(image.GetSpacing()) / 2 ** (image.GetDimension() + 1)
+    return sitk.CurvatureAnisotropicDiffusion(sitk.Cast(image, sitk.sitkFloat32), timeStep=time_step,
+                                              conductanceParameter=conductance, numberOfIterations=iterations)
+
+def bilateral(image, domain_sigma=1.0, range_sigma=50.0):
+    """Profile filter: bilateral filter (domain_sigma in physical units), multi-threaded by ITK."""
+    return sitk.Bilateral(image, domainSigma=domain_sigma, rangeSigma=range_sigma)
+
+def bilateral_radius(domain_sigma=1.0, spacing=(1.0, 1.0, 1.0)):
+    """Largest kernel radius in voxels of sitk.Bilateral: ceil(2.5 * domain_sigma / spacing)."""
+    return max(math.ceil(2.5 * domain_sigma / s) for s in spacing)
+
+def on_array(filter_function):
+    """Array version (for filters.DENOISERS) of a SimpleITK profile filter."""
+    def run(array, **params):
+        return sitk.GetArrayFromImage(filter_function(sitk.GetImageFromArray(array), **params))
+    return run
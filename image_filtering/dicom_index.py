@@ -0,0 +1,301 @@
+import argparse
+import hashlib
+import json
+import os
+import struct
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import SimpleITK as sitk
+
+try:
+    import fcntl
+except ImportError:  # Windows: catalog updates are not serialized
+    fcntl = None
+
+INDEX_NAME = "series_index.json"  # former location, inside the DICOM tree (skipped by the scans)
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INDEX_DIR = os.path.join(REPO_ROOT, "pipeline", "cache", "dicom_index")
+
+# key tags kept in the catalog
+TAGS = {
+    "uid": "0020|000e",
+    "description": "0008|103e",
+    "protocol": "0018|1030",
+    "modality": "0008|0060",
+    "instance": "0020|0013",
+    "position": "0020|0032",
+}
+
+EXPLICIT_VR_LE = "1.2.840.10008.1.2.1"
+LONG_VRS = {"OB", "OW", "OF", "OD", "OL", "OV", "SQ", "SV", "UC", "UN", "UR", "UT", "UV"}
+
+def read_header(path):
+    """Header-only read of one DICOM file (no pixel data)."""
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(path)
+    reader.ReadImageInformation()
+    header = {name: reader.GetMetaData(tag).strip() if reader.HasMetaDataKey(tag) else ""
+              for name, tag in TAGS.items()}
+    header.update(path=path, size=reader.GetSize(), spacing=reader.GetSpacing(),
+                  origin=reader.GetOrigin(), direction=reader.GetDirection())
+    return header
+
+def _slice_position(header, normal):
+    if header["position"]:
+        return float(np.dot([float(v) for v in header["position"].split("\\")], normal))
+    return float(header["instance"] or 0)
+
+def make_entry(directory, files, first, last):
+    """Catalog entry of one series from its sorted file names and its first and last slice headers."""
+    direction = first["direction"]
+    normal = np.array(direction).reshape(3, 3)[:, 2]
+    n = len(files)
+    return {
+        "uid": first["uid"],
+        "directory": directory,
+        "dir_mtime_ns": os.stat(directory).st_mtime_ns,
+        "files": files,
+        "description": first["description"],
+        "protocol": first["protocol"],
+        "modality": first["modality"],
+        "size": [first["size"][0], first["size"][1], n],
+        "origin": list(first["origin"]),
+        "spacing": [first["spacing"][0], first["spacing"][1],
+                    abs(_slice_position(last, normal) - _slice_position(first, normal)) / max(1, n - 1)],
+        "direction": list(direction),
+    }
+
+def sort_slices(headers):
+    """Sort slices along the slice normal, like GDCM does for ImageSeriesReader."""
+    normal = np.array(headers[0]["direction"]).reshape(3, 3)[:, 2]
+    return sorted(headers, key=lambda h: (_slice_position(h, normal), h["path"]))
+
+def scan_directory(directory, workers=8):
+    """Parallel header-only scan of the files of a directory, returns one entry per series UID."""
+    paths = sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                   if os.path.isfile(os.path.join(directory, f)) and f != INDEX_NAME)
+
+    def try_read(path):
+        try:
+            return read_header(path)
+        except RuntimeError:
+            return None  # not a DICOM file
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        headers = [h for h in pool.map(try_read, paths) if h is not None]
+
+    series = {}
+    for h in headers:
+        series.setdefault(h["uid"], []).append(h)
+    entries = []
+    for hs in series.values():
+        hs = sort_slices(hs)
+        entries.append(make_entry(directory, [h["path"] for h in hs], hs[0], hs[-1]))
+    return entries
+
+def read_dicomdir(dicomdir_path):
+    """
+    Minimal DICOMDIR reader (explicit VR little endian): returns the directory records as
+    dicts {(group, element): raw bytes}, in file order. Returns None for other transfer syntaxes.
+    """
+    with open(dicomdir_path, "rb") as f:
+        data = f.read()
+    if data[128:132] != b"DICM" or EXPLICIT_VR_LE.encode() not in data[132:1024]:
+        return None
+
+    records, current = [], None
+    pos = 132
+    while pos + 8 <= len(data):
+        group, element = struct.unpack_from("<HH", data, pos)
+        if group == 0xFFFE:
+            # item / delimiters have no VR: descend into the item, each item is a record
+            pos += 8
+            if element == 0xE000:
+                current = {}
+                records.append(current)
+            continue
+        vr = data[pos+4:pos+6].decode("ascii", "replace")
+        if vr in LONG_VRS:
+            length = struct.unpack_from("<I", data, pos + 8)[0]
+            pos += 12
+        else:
+            length = struct.unpack_from("<H", data, pos + 6)[0]
+            pos += 8
+        if vr == "SQ" or length == 0xFFFFFFFF:
+            continue
+        if current is not None:
+            current[(group, element)] = data[pos:pos+length]
+        pos += length
+    return records
+
+def _text(value):
+    return value.decode("ascii", "replace").strip("\x00 ") if value else ""
+
+def index_from_dicomdir(dicomdir_path, dicom_root):
+    """
+    Group the files of the DICOMDIR by series. The referenced file IDs are matched case-insensitively
+    (and with or without .dcm) since the tree may have been renamed. Slices are ordered by instance
+    number and only the first and last headers are read to get the geometry and the slice direction.
+    Returns None when the DICOMDIR cannot be used.
+    """
+    records = read_dicomdir(dicomdir_path)
+    if not records:
+        return None
+
+    base = os.path.dirname(os.path.abspath(dicomdir_path))
+    actual = {}
+    for dirpath, _, filenames in os.walk(dicom_root):
+        for f in filenames:
+            rel = os.path.relpath(os.path.join(dirpath, f), base).lower().replace("\\", "/")
+            actual[rel] = os.path.join(dirpath, f)
+            actual[os.path.splitext(rel)[0]] = os.path.join(dirpath, f)
+
+    series, current = {}, None
+    for record in records:
+        kind = _text(record.get((0x0004, 0x1430)))
+        if kind == "SERIES":
+            current = series.setdefault(_text(record.get((0x0020, 0x000E))), [])
+        elif kind == "IMAGE" and current is not None:
+            ref = _text(record.get((0x0004, 0x1500))).replace("\\", "/").lower()
+            if ref not in actual:
+                return None  # DICOMDIR does not describe this tree
+            instance = _text(record.get((0x0020, 0x0013)))
+            current.append((int(instance) if instance.isdigit() else 0, actual[ref]))
+
+    entries = []
+    for files in series.values():
+        if not files:
+            continue
+        files = [path for _, path in sorted(files)]
+        first, last = read_header(files[0]), read_header(files[-1])
+        normal = np.array(first["direction"]).reshape(3, 3)[:, 2]
+        if _slice_position(last, normal) < _slice_position(first, normal):
+            files.reverse()
+            first, last = last, first
+        entries.append(make_entry(os.path.dirname(files[0]), files, first, last))
+    return entries
+
+def build_index(dicom_root, use_dicomdir=True, workers=8):
+    """Catalog of every series under dicom_root, from the DICOMDIR next to it if usable, else by scanning."""
+    dicom_root = os.path.abspath(dicom_root)
+    dicomdir = os.path.join(os.path.dirname(os.path.abspath(dicom_root)), "DICOMDIR")
+    entries = None
+    if use_dicomdir and os.path.exists(dicomdir):
+        entries = index_from_dicomdir(dicomdir, dicom_root)
+        if entries is not None:
+            print(f"Indexed {len(entries)} series from {dicomdir}")
+    if entries is None:
+        entries = []
+        for dirpath, _, filenames in os.walk(dicom_root):
+            if any(f != INDEX_NAME for f in filenames):
+                entries += scan_directory(dirpath, workers)
+        print(f"Indexed {len(entries)} series by scanning {dicom_root}")
+    return {"root": dicom_root, "series": {e["uid"]: e for e in entries}}
+
+def index_path(dicom_root):
+    """Catalog of dicom_root in INDEX_DIR, named after its path relative to the repository."""
+    rel = os.path.relpath(os.path.abspath(dicom_root), REPO_ROOT)
+    return os.path.join(INDEX_DIR, f"{os.path.basename(os.path.abspath(dicom_root))}_"
+                                   f"{hashlib.sha1(rel.encode()).hexdigest()[:12]}.json")
+
+@contextmanager
+def _locked(dicom_root):
+    """Exclusive lock of the catalog of dicom_root, for its read-modify-write updates."""
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    with open(index_path(dicom_root) + ".lock", "w") as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+def _read_index(dicom_root):
+    """Catalog of dicom_root with absolute paths (the file stores them relative to the root)."""
+    root = os.path.abspath(dicom_root)
+    index = {"root": root, "series": {}}
+    if os.path.exists(index_path(root)):
+        with open(index_path(root)) as f:
+            for uid, entry in json.load(f)["series"].items():
+                entry["directory"] = os.path.normpath(os.path.join(root, entry["directory"]))
+                entry["files"] = [os.path.normpath(os.path.join(root, p)) for p in entry["files"]]
+                index["series"][uid] = entry
+    return index
+
+def save_index(index, dicom_root):
+    root = os.path.abspath(dicom_root)
+    series = {uid: {**e, "directory": os.path.relpath(e["directory"], root),
+                    "files": [os.path.relpath(p, root) for p in e["files"]]}
+              for uid, e in index["series"].items()}
+    path = index_path(root)
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}"
+    with open(tmp, "w") as f:
+        json.dump({"root": ".", "series": series}, f, indent=1)
+    os.replace(tmp, path)
+
+def load_index(dicom_root, rebuild=False, use_dicomdir=True):
+    """Load the catalog of dicom_root, building and saving it first if needed."""
+    if not rebuild and os.path.exists(index_path(dicom_root)):
+        return _read_index(dicom_root)
+    index = build_index(dicom_root, use_dicomdir)
+    with _locked(dicom_root):
+        save_index(index, dicom_root)
+    return index
+
+def find_series(index, directory):
+    """Entry of the (first) series stored in directory, None if unknown or modified since indexing."""
+    directory = os.path.abspath(directory)
+    for entry in sorted(index["series"].values(), key=lambda e: e["uid"]):
+        if os.path.abspath(entry["directory"]) == directory:
+            if entry["dir_mtime_ns"] != os.stat(directory).st_mtime_ns:
+                return None
+            return entry
+    return None
+
+def series_entry(dicom_dir):
+    """
+    Catalog entry of the series in dicom_dir, from the catalog of its parent folder. A missing or
+    outdated series is scanned once and added to the catalog. None if dicom_dir holds no DICOM file.
+    """
+    dicom_dir = os.path.abspath(dicom_dir.rstrip("/\\"))
+    root = os.path.dirname(dicom_dir)
+    entry = find_series(_read_index(root), dicom_dir)
+    if entry is None:
+        entries = scan_directory(dicom_dir)
+        if not entries:
+            return None
+        try:
+            # merge into the catalog as it is now: other workers may have added series meanwhile
+            with _locked(root):
+                index = _read_index(root)
+                index["series"] = {uid: e for uid, e in index["series"].items()
+                                   if os.path.abspath(e["directory"]) != dicom_dir}
+                index["series"].update({e["uid"]: e for e in entries})
+                save_index(index, root)
+        except OSError:
+            pass  # read-only location, the catalog is only an optimization
+        entry = find_series({"series": {e["uid"]: e for e in entries}}, dicom_dir)
+    return entry
+
+def series_files(dicom_dir):
+    """Sorted file names of the series in dicom_dir, in place of ImageSeriesReader.GetGDCMSeriesFileNames."""
+    entry = series_entry(dicom_dir)
+    return tuple(entry["files"]) if entry else ()
+
+def read_series(dicom_dir):
+    """Read a DICOM series volume using the catalog file list."""
+    reader = sitk.ImageSeriesReader()
+    reader.SetFileNames(series_files(dicom_dir))
+    return reader.Execute()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the catalog of the DICOM series.")
+    parser.add_argument("dicom_root", nargs="?", default="DICOM")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild even if the catalog exists.")
+    parser.add_argument("--no-dicomdir", action="store_true", help="Always scan the headers, ignore DICOMDIR.")
+    args = parser.parse_args()
+
+    index = load_index(args.dicom_root, rebuild=args.rebuild, use_dicomdir=not args.no_dicomdir)
+    for entry in sorted(index["series"].values(), key=lambda e: e["directory"]):
+        print(f"{entry['directory']}: {entry['description']} ({entry['modality']}), "
+              f"size {entry['size']}, spacing {[round(s, 3) for s in entry['spacing']]}")
@@ -1,5 +1,8 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from scipy.ndimage import gaussian_filter
+from scipy.ndimage import gaussian_filter, median_filter
 from imageio import imread, imwrite
 
 import matplotlib.pyplot as plt
@@ -39,138 +42,233 @@ def gaussian_denoise(input_filename, output_filename=None, sigma=1.0):
 # Example usage:
 # denoised_image_path = gaussian_denoise('input_image.jpg', 'output_image.jpg')
 
-def add_gaussian_noise(input_filename, input_dir="images/", output_dir=None):
+def _denoiser(name, sitk_filter=False):
     """
-        Add Gaussian noise to an image.
+    Denoiser of denoisers.py, imported on the first call so that the noise helpers (and the
+    workers of add_noise_files) do not load SimpleITK.
+    """
+    def denoise(image, **params):
+        import denoisers
+        function = getattr(denoisers, name)
+        return (denoisers.on_array(function) if sitk_filter else function)(image, **params)
+    return denoise
+
+# denoiser name -> function(float32 image or volume, **params) -> denoised array
+DENOISERS = {
+    "gaussian": lambda image, sigma=1.0: gaussian_filter(image, sigma=sigma),
+    "median": lambda image, size=3: median_filter(image, size=size),
+    "non_local_means": _denoiser("nlm_tiled"),
+    "curvature_diffusion": _denoiser("curvature_diffusion", sitk_filter=True),
+    "bilateral": _denoiser("bilateral", sitk_filter=True),
+}
+
+def gaussian_noise(noisy, rng, scale=25, buffer=None, buffer2=None):
+    """
+        Add zero-mean Gaussian noise in place.
         Parameters:
-        input_filename (str): Path to the input image file.
+        noisy (ndarray): float32 image, modified in place.
+        rng (np.random.Generator): Random generator of this item.
+        scale (float, optional): Standard deviation of the noise. Default is 25.
+        buffer (ndarray, optional): float32 scratch array of the same shape, reused between items.
+        buffer2 (ndarray, optional): second scratch array, unused.
+    """
+    buffer = rng.standard_normal(noisy.shape, dtype=np.float32, out=buffer)
+    buffer *= scale
+    noisy += buffer
+
+def rician_noise(noisy, rng, v=8, s=5, buffer=None, buffer2=None):
+    """
+        Add the magnitude of a complex Gaussian noise of mean (v, 0) and deviation s in place,
+        computed in float32 on the two scratch arrays buffer and buffer2 (no (N, 2) float64 array).
+    """
+    real = rng.standard_normal(noisy.shape, dtype=np.float32, out=buffer)
+    imag = rng.standard_normal(noisy.shape, dtype=np.float32, out=buffer2)
+    real *= s
+    real += v
+    real *= real
+    imag *= s
+    imag *= imag
+    real += imag
+    np.sqrt(real, out=real)
+    noisy += real
+
+def salt_and_pepper_noise(noisy, rng, p=0.05, q=0.05, low=0, high=255, buffer=None, buffer2=None):
+    """
+        Set a fraction p of the pixels to low (pepper) and a fraction q to high (salt), in place.
+    """
+    u = rng.random(noisy.shape, dtype=np.float32, out=buffer)
+    noisy[u < p] = low
+    noisy[(u >= p) & (u < p + q)] = high
+
+# noise model name -> function(noisy float32 array, rng, **params, buffer=None, buffer2=None)
+NOISE_MODELS = {
+    "gaussian": gaussian_noise,
+    "rician": rician_noise,
+    "salt_and_pepper": salt_and_pepper_noise,
+}
+
+def item_rng(seed, *key):
+    """
+        Generator of one item of a batch: the same (seed, key) always gives the same noise,
+        whatever the other items of the batch or the worker that computes it.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=key))
+
+def add_noise(image, model, rng, clip=(0, 255), out=None, buffer=None, buffer2=None, work=None, **params):
+    """
+        Noisy copy of an image or volume with the noise model (see NOISE_MODELS).
+        Parameters:
+        image (ndarray): Input image, 2D, 3D or a volume.
+        model (str): Noise model name.
+        rng (np.random.Generator): Random generator.
+        clip (tuple, optional): Value range of the result, None to keep float32. Default is (0, 255).
+        out (ndarray, optional): Array of the result (dtype of the image, or float32 when clip is None).
+        buffer, buffer2 (ndarray, optional): float32 scratch arrays of the image shape, reused between items.
+        work (ndarray, optional): float32 array of the image shape receiving the noisy float copy, reused
+                                  between items instead of allocating one per call.
         Returns:
-        ndarray: Noisy image array.
-        Raises:
-        FileNotFoundError: If the input file is not found.
+        ndarray: Noisy image, clipped and cast back to the image dtype unless clip is None.
+    """
+    if work is None:
+        noisy = image.astype(np.float32)
+    else:
+        noisy = work
+        np.copyto(noisy, image)
+    NOISE_MODELS[model](noisy, rng, buffer=buffer, buffer2=buffer2, **params)
+    if clip is None:
+        if out is None:
+            return noisy if work is None else noisy.copy()
+        out[...] = noisy
+        return out
+    np.clip(noisy, clip[0], clip[1], out=noisy)
+    if out is None:
+        return noisy.astype(image.dtype)
+    out[...] = noisy
+    return out
+
+def add_noise_batch(stack, model, seed=0, clip=(0, 255), **params):
+    """
+        Noisy version of every item of a stack (first axis: 2D slices of a volume, or images of the
+        same shape), item i drawn with item_rng(seed, i). The result is preallocated once, and the
+        float32 working copy and the two scratch arrays are allocated once and reused for every item.
+        Returns:
+        ndarray: Noisy stack, same shape (and dtype unless clip is None).
     """
+    out = np.empty(stack.shape, dtype=stack.dtype if clip is not None else np.float32)
+    work, buffer, buffer2 = np.empty((3,) + stack.shape[1:], dtype=np.float32)
+    for i in range(len(stack)):
+        add_noise(stack[i], model, item_rng(seed, i), clip, out=out[i], buffer=buffer, buffer2=buffer2, work=work,
+                  **params)
+    return out
+
+def parameter_grid(grid):
+    """
+        All combinations of a parameter grid, e.g. {"scale": [10, 25], ...} -> [{"scale": 10}, ...].
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+def noise_sweep(image, model, grid, repeats=1, seed=0, clip=(0, 255)):
+    """
+        Yield (params, repeat, noisy image) for every combination of grid and repeats.
+        Variant (j, r) uses item_rng(seed, j, r), so it can be regenerated on its own.
+    """
+    work, buffer, buffer2 = np.empty((3,) + image.shape, dtype=np.float32)
+    for j, params in enumerate(parameter_grid(grid)):
+        for r in range(repeats):
+            yield params, r, add_noise(image, model, item_rng(seed, j, r), clip, buffer=buffer, buffer2=buffer2,
+                                       work=work, **params)
+
+NOISE_SUFFIXES = {"gaussian": "_gnoise", "rician": "_rnoise", "salt_and_pepper": "_spnoise"}
+
+def _noise_file(task):
+    filepath, output_filename, model, seed, key, params = task
+    image = imread(filepath)
+    imwrite(output_filename, add_noise(image, model, item_rng(seed, *key), **params))
+    return output_filename
+
+def add_noise_files(filenames, model, input_dir="images/", output_dir="", seed=0, grid=None, repeats=1, workers=None):
+    """
+        Write noisy variants of image files in a process pool.
+        Parameters:
+        filenames (list): Image file names (relative to input_dir).
+        model (str): Noise model name (see NOISE_MODELS).
+        seed (int, optional): Base seed, file i / variant (j, r) uses item_rng(seed, i, j, r).
+        grid (dict, optional): Parameter sweep, e.g. {"s": [2, 5, 10]}; default parameters if None.
+        repeats (int, optional): Noisy variants per parameter combination.
+        workers (int, optional): Number of processes (default: number of cores).
+        Returns:
+        list: Paths of the written files.
+    """
+    tasks = []
+    combinations = parameter_grid(grid) if grid else [{}]
+    for i, name in enumerate(filenames):
+        base, ext = name.rsplit('.', 1)
+        for j, params in enumerate(combinations):
+            for r in range(repeats):
+                tag = "".join(f"_{k}{v}" for k, v in params.items()) + (f"_r{r}" if repeats > 1 else "")
+                output_filename = output_dir + base + NOISE_SUFFIXES[model] + tag + '.' + ext
+                tasks.append((input_dir + name, output_filename, model, seed, (i, j, r), params))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_noise_file, tasks, chunksize=max(1, len(tasks) // (4 * (workers or os.cpu_count() or 1)))))
+
+def _add_noise_to_file(input_filename, input_dir, output_dir, model, seed, **params):
     filepath = input_dir + input_filename
-    print(filepath)
     # Read the input image
     image = imread(filepath)
-    
-    print(image.shape)
-    
+
     if image is None:
         raise FileNotFoundError(f"Input file {filepath} not found.")
-    
-    # Generate Gaussian noise
-    noise = np.random.normal(loc=0, scale=25, size=image.shape)
-    
-    # Add Gaussian noise to the image
-    noisy_image = image + noise
-    print(noisy_image.shape)
-    
-    noisy_image = np.clip(noisy_image, 0, 255).astype(np.uint8)
-    
-    print(noisy_image.shape)
-    
+
+    noisy_image = add_noise(image, model, np.random.default_rng(seed), **params).astype(np.uint8)
+
     # Extract the filename without extension
     base_filename = input_filename.rsplit('.', 1)[0]
-    if output_dir:
-        # Create the output filename by adding '_gnoise' before the extension
-        output_filename = output_dir + base_filename + '_gnoise.' + input_filename.rsplit('.', 1)[1]
-    else:
-        output_filename = base_filename + '_gnoise.' + input_filename.rsplit('.', 1)[1]
-        
-    print(noisy_image.shape)
-    
+    output_filename = (output_dir or "") + base_filename + NOISE_SUFFIXES[model] + '.' + input_filename.rsplit('.', 1)[1]
+
     # Save the noisy image
     imwrite(output_filename, noisy_image)
-    
+
     return output_filename
 
-def add_rician_noise(input_filename, input_dir="images/", output_dir=None):
+def add_gaussian_noise(input_filename, input_dir="images/", output_dir=None, seed=None):
     """
-        Add Rician noise to an image.
+        Add Gaussian noise to an image.
         Parameters:
         input_filename (str): Path to the input image file.
+        seed (int, optional): Seed of the noise, random if None.
         Returns:
-        ndarray: Noisy image array.
+        str: Path to the saved noisy image file.
         Raises:
         FileNotFoundError: If the input file is not found.
     """
-    filepath = input_dir + input_filename
-    # Read the input image
-    image = imread(filepath)
-    
-    if image is None:
-        raise FileNotFoundError(f"Input file {filepath} not found.")
-    
-    # Parameters of Rician noise
-    v = 8
-    s = 5
-    N = image.size
+    return _add_noise_to_file(input_filename, input_dir, output_dir, "gaussian", seed, scale=25)
 
-    noise = np.random.normal(scale=s, size=(N, 2)) + [[v,0]]
-    noise = np.linalg.norm(noise, axis=1)
-    
-    # Add Gaussian noise to the image
-    noisy_image = image + noise.reshape(image.shape)
-    
-    noisy_image = np.clip(noisy_image, 0, 255).astype(np.uint8)
-    
-    # Extract the filename without extension
-    base_filename = input_filename.rsplit('.', 1)[0]
-    if output_dir:
-        # Create the output filename by adding '_gnoise' before the extension
-        output_filename = output_dir + base_filename + '_rnoise.' + input_filename.rsplit('.', 1)[1]
-    else:
-        output_filename = base_filename + '_rnoise.' + input_filename.rsplit('.', 1)[1]
-    # Save the noisy image
-    imwrite(output_filename, noisy_image)
-    
-    return output_filename
+def add_rician_noise(input_filename, input_dir="images/", output_dir=None, seed=None):
+    """
+        Add Rician noise to an image.
+        Parameters:
+        input_filename (str): Path to the input image file.
+        seed (int, optional): Seed of the noise, random if None.
+        Returns:
+        str: Path to the saved noisy image file.
+        Raises:
+        FileNotFoundError: If the input file is not found.
+    """
+    return _add_noise_to_file(input_filename, input_dir, output_dir, "rician", seed, v=8, s=5)
 
-def add_salt_and_pepper_noise(input_filename, input_dir="images/", output_dir=None):
+def add_salt_and_pepper_noise(input_filename, input_dir="images/", output_dir=None, seed=None):
     """
         Add Salt and Pepper noise to an image.
         Parameters:
         input_filename (str): Path to the input image file.
+        seed (int, optional): Seed of the noise, random if None.
         Returns:
-        ndarray: Noisy image array.
+        str: Path to the saved noisy image file.
         Raises:
         FileNotFoundError: If the input file is not found.
     """
-    filepath = input_dir + input_filename
-    # Read the input image
-    image = imread(filepath)
-    
-    if image is None:
-        raise FileNotFoundError(f"Input file {filepath} not found.")
-    
-    # Parameters of Salt and Pepper noise
-    p = 0.05
-    q = 0.05
-    N = image.size
-    
-    # Generate Salt and Pepper noise
-    noise = np.random.choice([0, 1, 2], size=N, p=[1-p-q, p, q])
-    noise = noise.reshape(image.shape)
-    
-    # Add Salt and Pepper noise to the image
-    noisy_image = image.copy()
-    noisy_image[noise == 1] = 0
-    noisy_image[noise == 2] = 255
-    
-    noisy_image = np.clip(noisy_image, 0, 255).astype(np.uint8)
-    
-    # Extract the filename without extension
-    base_filename = input_filename.rsplit('.', 1)[0]
-    if output_dir:
-        # Create the output filename by adding '_gnoise' before the extension
-        output_filename = output_dir + base_filename + '_spnoise.' + input_filename.rsplit('.', 1)[1]
-    else:
-        output_filename = base_filename + '_spnoise.' + input_filename.rsplit('.', 1)[1]
-    # Save the noisy image
-    imwrite(output_filename, noisy_image)
-    
-    return output_filename
+    return _add_noise_to_file(input_filename, input_dir, output_dir, "salt_and_pepper", seed, p=0.05, q=0.05)
 
 def display_images(noise_img_path, denoised_img_path, original_img_path):
     fig, axes = plt.subplots(1, 3, figsize=(15, 5))
@@ -188,4 +286,23 @@ def display_images(noise_img_path, denoised_img_path, original_img_path):
     ax[2].set_title('Denoised Image')
     ax[2].axis('off')
 
-    plt.show()
\ No newline at end of file
+    plt.show()
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Write reproducible noisy variants of images.")
+    parser.add_argument("filenames", nargs="+", help="Image file names, relative to --input-dir.")
+    parser.add_argument("--model", choices=sorted(NOISE_MODELS), default="gaussian")
+    parser.add_argument("--input-dir", default="image_filtering/images/")
+    parser.add_argument("--output-dir", default="image_filtering/images/denoise_test/")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--grid", type=json.loads, default=None, help='Parameter sweep, e.g. \'{"scale": [10, 25, 40]}\'.')
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    written = add_noise_files(args.filenames, args.model, args.input_dir, args.output_dir, args.seed,
+                              args.grid, args.repeats, args.workers)
+    print(f"Wrote {len(written)} noisy images to {args.output_dir}")
@@ -0,0 +1,136 @@
+import fnmatch
+import json
+import os
+import SimpleITK as sitk
+
+from denoisers import bilateral, bilateral_radius, curvature_diffusion, non_local_means
+
+PROFILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles.json")
+
+# DICOM tags read from the first file of a series to match the profiles
+MATCH_TAGS = ("0008|103e", "0018|1030", "0008|0060")
+
+def median(image, radius=1):
+    median_filter = sitk.MedianImageFilter()
+    median_filter.SetRadius(radius)
+    return median_filter.Execute(image)
+
+def otsu_value(image_2d, offset=1.5):
+    """Otsu threshold of a (projection) image, divided by offset."""
+    otsu_filter = sitk.OtsuThresholdImageFilter()
+    otsu_filter.SetInsideValue(0)
+    otsu_filter.SetOutsideValue(1)
+    otsu_filter.Execute(image_2d)
+    return otsu_filter.GetThreshold() / offset
+
+def threshold_below(image, value):
+    """Zero the voxels below value."""
+    return sitk.Threshold(image, lower=value, upper=65535, outsideValue=0)
+
+def otsu_mip_threshold(image, offset=1.5, axis=2):
+    """Zero the voxels below the Otsu threshold of the maximum projection, divided by offset."""
+    image_2d = sitk.MaximumProjection(image, axis)
+    return threshold_below(image, otsu_value(image_2d, offset))
+
+def binarize(image, inside_value=255):
+    return sitk.BinaryThreshold(image, lowerThreshold=1, upperThreshold=65535, insideValue=inside_value, outsideValue=0)
+
+# filter "type" of the profile file -> function(image, **params)
+FILTERS = {
+    "median": median,
+    "otsu_mip_threshold": otsu_mip_threshold,
+    "binarize": binarize,
+    "threshold_below": threshold_below,
+    "non_local_means": non_local_means,
+    "curvature_diffusion": curvature_diffusion,
+    "bilateral": bilateral,
+}
+
+def _nlm_halo(spacing, patch_radius=1, search_radius=3, sigma=None, **params):
+    # a slab would estimate its own noise level, hence its own h: the result would depend on the slabs
+    if sigma is None:
+        raise ValueError("non_local_means can only be streamed with an explicit sigma")
+    return patch_radius + search_radius
+
+# voxels of margin a filter needs around a slab to give the same result as on the whole volume
+# (streaming.py), given the voxel spacing; 0 for voxel-wise filters, filters missing here cannot be streamed
+HALO = {
+    "median": lambda spacing, radius=1: max(radius) if isinstance(radius, (list, tuple)) else radius,
+    "binarize": lambda spacing, inside_value=255: 0,
+    "threshold_below": lambda spacing, value: 0,
+    # curvature_diffusion is not local: ITK scales the conductance by the mean gradient of the whole image
+    "non_local_means": _nlm_halo,
+    "bilateral": lambda spacing, domain_sigma=1.0, range_sigma=50.0: bilateral_radius(domain_sigma, spacing),
+}
+
+def apply_voi(image, voi, crop=False):
+    """Keep only the VOI (xmin, xmax, ymin, ymax, zmin, zmax, inclusive) using region copies."""
+    size = image.GetSize()
+    # clamp to the image like numpy slicing would
+    lower = [max(0, voi[2*d]) for d in range(3)]
+    upper = [min(size[d] - 1, voi[2*d + 1]) for d in range(3)]
+    region_size = [u - l + 1 for l, u in zip(lower, upper)]
+
+    region = sitk.RegionOfInterest(image, region_size, lower)
+    if crop:
+        return region
+
+    # paste the VOI back into an empty image with the same geometry
+    out = sitk.Image(size, image.GetPixelID(), image.GetNumberOfComponentsPerPixel())
+    out.CopyInformation(image)
+    return sitk.Paste(out, region, region_size, [0, 0, 0], lower)
+
+def load_profiles(path=PROFILES_PATH):
+    with open(path) as f:
+        config = json.load(f)
+    for profile in [config["default"]] + config["profiles"]:
+        for step in profile.get("filters", []):
+            if step["type"] not in FILTERS:
+                raise ValueError(f"Unknown filter type '{step['type']}' in {path}")
+    return config
+
+def read_series_tags(path):
+    """Header-only read of the matching tags of the first file of a DICOM series."""
+    if not os.path.isdir(path):
+        return {}
+    files = sorted(f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f)))
+    if not files:
+        return {}
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(os.path.join(path, files[0]))
+    try:
+        reader.ReadImageInformation()
+    except RuntimeError:
+        return {}
+    return {tag: reader.GetMetaData(tag).strip() for tag in MATCH_TAGS if reader.HasMetaDataKey(tag)}
+
+def _matches(rule, series_name, tags):
+    if "series" in rule and not fnmatch.fnmatch(series_name, rule["series"]):
+        return False
+    for tag, pattern in rule.get("tags", {}).items():
+        if tag not in tags or not fnmatch.fnmatch(tags[tag], pattern):
+            return False
+    return True
+
+def resolve_profile(config, series_name, tags=None):
+    """First profile with a matching rule (series name glob and/or DICOM tag globs), else the default."""
+    tags = tags or {}
+    for profile in config["profiles"]:
+        if any(_matches(rule, series_name, tags) for rule in profile["match"]):
+            return {**config["default"], **profile}
+    print(f"No profile matches {series_name}, using the default profile")
+    return {**config["default"], "name": "default"}
+
+def run_profile(image, profile):
+    """Orientation, filter chain then VOI of a resolved profile."""
+    if profile.get("orientation"):
+        print(f"Changing orientation to {profile['orientation']}")
+        image = sitk.DICOMOrient(image, profile["orientation"])
+    for step in profile["filters"]:
+        params = {k: v for k, v in step.items() if k != "type"}
+        image = FILTERS[step["type"]](image, **params)
+    if profile.get("voi"):
+        voi = profile["voi"]
+        image = apply_voi(image, voi["voi"], voi.get("crop", False))
+        print(f"Applied VOI {voi['voi']} ({'cropped' if voi.get('crop') else 'masked, not cropped'})")
+    return image
@@ -0,0 +1,179 @@
+import argparse
+import glob
+import os
+import numpy as np
+import SimpleITK as sitk
+import pyvista as pv
+from vtk.util import numpy_support
+
+# MetaImage element types <-> NumPy dtypes
+MET_TYPES = {
+    "MET_UCHAR": np.uint8, "MET_CHAR": np.int8,
+    "MET_USHORT": np.uint16, "MET_SHORT": np.int16,
+    "MET_UINT": np.uint32, "MET_INT": np.int32,
+    "MET_ULONG_LONG": np.uint64, "MET_LONG_LONG": np.int64,
+    "MET_FLOAT": np.float32, "MET_DOUBLE": np.float64,
+}
+
+class RawVolume:
+    """
+    Uncompressed MetaImage volume (.mhd header + .raw data, also readable by sitk.ReadImage,
+    ParaView or 3D Slicer) whose voxels are a np.memmap of shape (z, y, x) or (z, y, x, components).
+    The conversions below share that buffer instead of copying it.
+    """
+
+    def __init__(self, array, origin, spacing, direction, path=None):
+        self.array = array
+        self.origin = tuple(origin)
+        self.spacing = tuple(spacing)
+        self.direction = tuple(float(v) for v in direction)
+        self.path = path
+
+    @property
+    def dimensions(self):
+        return self.array.shape[2::-1]
+
+    @property
+    def n_components(self):
+        return self.array.shape[3] if self.array.ndim == 4 else 1
+
+    def point_array(self):
+        """Voxels as VTK/PyVista point data, (n_points,) or (n_points, components): x varies fastest."""
+        return self.array.reshape((-1, self.n_components) if self.array.ndim == 4 else -1)
+
+    def to_sitk(self):
+        """SimpleITK image sharing the buffer when SimpleITK provides GetImageViewFromArray, else a copy."""
+        is_vector = self.array.ndim == 4
+        if hasattr(sitk, "GetImageViewFromArray"):
+            image = sitk.GetImageViewFromArray(self.array, isVector=is_vector)
+        else:
+            image = sitk.GetImageFromArray(self.array, isVector=is_vector)
+        image.SetOrigin(self.origin)
+        image.SetSpacing(self.spacing)
+        image.SetDirection(self.direction)
+        return image
+
+    def to_vtk(self, name="scalars"):
+        """
+        vtkImageData (a pyvista.ImageData, same origin and spacing as pv.read of a .vtk) whose point
+        data wraps the memory map (numpy_to_vtk without deep copy).
+        """
+        image = pv.ImageData(dimensions=self.dimensions, spacing=self.spacing, origin=self.origin)
+        self.add_to(image, name)
+        image.GetPointData().SetActiveScalars(name)
+        return image
+
+    to_pyvista = to_vtk
+
+    def add_to(self, image, name):
+        """Add the voxels as a point array of an image with the same dimensions, without copy."""
+        if tuple(image.dimensions) != tuple(self.dimensions):
+            raise ValueError(f"{self.path} dimensions {self.dimensions} do not match {image.dimensions}")
+        vtk_array = numpy_support.numpy_to_vtk(self.point_array(), deep=False)
+        vtk_array.SetName(name)
+        image.GetPointData().AddArray(vtk_array)
+        # keep the memory maps open while VTK uses them
+        image._raw_volumes = getattr(image, "_raw_volumes", []) + [self]
+
+def _parse_header(path):
+    header = {}
+    with open(path) as f:
+        for line in f:
+            if "=" in line:
+                key, value = line.split("=", 1)
+                header[key.strip()] = value.strip()
+    return header
+
+def open_raw(path, mode="r"):
+    """Memory-map a .mhd/.raw volume. mode "r+" maps it writable (in place processing)."""
+    header = _parse_header(path)
+    if header.get("CompressedData", "False") == "True" or header.get("ElementDataFile") == "LIST":
+        raise ValueError(f"{path} is not a single uncompressed raw file, it cannot be memory mapped")
+    dtype = np.dtype(MET_TYPES[header["ElementType"]])
+    dtype = dtype.newbyteorder(">" if header.get("BinaryDataByteOrderMSB", "False") == "True" else "<")
+    size = [int(v) for v in header["DimSize"].split()]
+    components = int(header.get("ElementNumberOfChannels", 1))
+    shape = tuple(size[::-1]) + ((components,) if components > 1 else ())
+
+    data_path = os.path.join(os.path.dirname(path), header["ElementDataFile"])
+    array = np.memmap(data_path, dtype=dtype, mode=mode, offset=int(header.get("HeaderSize", 0)), shape=shape)
+    # TransformMatrix is stored column by column
+    transform = np.array([float(v) for v in header.get("TransformMatrix", "1 0 0 0 1 0 0 0 1").split()])
+    direction = transform.reshape(3, 3).T.ravel()
+    origin = [float(v) for v in header.get("Offset", "0 0 0").split()]
+    spacing = [float(v) for v in header.get("ElementSpacing", "1 1 1").split()]
+    return RawVolume(array, origin, spacing, direction, path)
+
+def create_raw(path, shape, dtype, origin=(0, 0, 0), spacing=(1, 1, 1), direction=(1, 0, 0, 0, 1, 0, 0, 0, 1)):
+    """Write the header of a new (z, y, x[, components]) volume and return it memory-mapped for writing."""
+    dtype = np.dtype(dtype)
+    met_type = next(k for k, v in MET_TYPES.items() if np.dtype(v) == dtype.newbyteorder("="))
+    raw_name = os.path.splitext(os.path.basename(path))[0] + ".raw"
+    lines = [
+        "ObjectType = Image",
+        "NDims = 3",
+        "BinaryData = True",
+        "BinaryDataByteOrderMSB = False",
+        "CompressedData = False",
+        "TransformMatrix = " + " ".join(f"{v:g}" for v in np.reshape(direction, (3, 3)).T.ravel()),
+        "Offset = " + " ".join(repr(float(v)) for v in origin),
+        "ElementSpacing = " + " ".join(repr(float(v)) for v in spacing),
+        "DimSize = " + " ".join(str(s) for s in shape[2::-1]),
+    ]
+    if len(shape) == 4:
+        lines.append(f"ElementNumberOfChannels = {shape[3]}")
+    lines += [f"ElementType = {met_type}", f"ElementDataFile = {raw_name}"]
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+    array = np.memmap(os.path.join(os.path.dirname(path), raw_name), dtype=dtype.newbyteorder("<"),
+                      mode="w+", shape=tuple(shape))
+    return RawVolume(array, origin, spacing, direction, path)
+
+def write_raw(array, path, origin=(0, 0, 0), spacing=(1, 1, 1), direction=(1, 0, 0, 0, 1, 0, 0, 0, 1)):
+    volume = create_raw(path, array.shape, array.dtype, origin, spacing, direction)
+    volume.array[...] = array
+    volume.array.flush()
+    return volume
+
+def open_volume(path):
+    """
+    pyvista.ImageData of a volume, pv.read for the VTK formats. A .mhd is memory-mapped as the
+    "scalars" array, with its <name>.<array>.mhd siblings (e.g. Sag_Flux.vectors.mhd) as other arrays.
+    """
+    if not path.endswith(".mhd"):
+        return pv.read(path)
+    image = open_raw(path).to_pyvista()
+    for array_path in sorted(glob.glob(glob.escape(path[:-len(".mhd")]) + ".*.mhd")):
+        open_raw(array_path).add_to(image, array_path[:-len(".mhd")].rsplit(".", 1)[1])
+    return image
+
+def convert_to_raw(input_path, output_dir=None):
+    """
+    Write every point array of a VTK image file as <name>.mhd (the "scalars" array, or the only one)
+    or <name>.<array>.mhd. Returns the written header paths.
+    """
+    grid = pv.read(input_path)
+    if not isinstance(grid, pv.ImageData):
+        raise ValueError(f"{input_path} is not an image (structured points) dataset")
+    base = os.path.splitext(os.path.basename(input_path))[0]
+    output_dir = output_dir or os.path.dirname(input_path)
+    written = []
+    for name in grid.point_data.keys():
+        values = np.asarray(grid.point_data[name])
+        shape = tuple(grid.dimensions[::-1]) + values.shape[1:]
+        suffix = "" if name == "scalars" or len(grid.point_data) == 1 else f".{name}"
+        path = os.path.join(output_dir, f"{base}{suffix}.mhd")
+        write_raw(values.reshape(shape), path, grid.origin, grid.spacing)
+        print(f"Saved {name} to {path}")
+        written.append(path)
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert VTK image files to memory-mappable .mhd/.raw volumes.")
+    parser.add_argument("inputs", nargs="+")
+    parser.add_argument("--output-dir", default=None, help="Default: next to each input.")
+    args = parser.parse_args()
+
+    for input_path in args.inputs:
+        convert_to_raw(input_path, args.output_dir)
@@ -0,0 +1,163 @@
+import os
+import tempfile
+import numpy as np
+import SimpleITK as sitk
+
+from dicom_index import series_entry
+from dicom_loader import read_files
+from profiles import FILTERS, HALO, otsu_value
+from raw_volume import create_raw, write_raw
+
+# filters that need the whole volume: their statistic is accumulated over a first pass
+GLOBAL_FILTERS = ("otsu_mip_threshold",)
+
+def orientation_mapping(direction, orientation):
+    """(permute order, flip axes) that sitk.DICOMOrient applies for this direction."""
+    orient_filter = sitk.DICOMOrientImageFilter()
+    orient_filter.SetDesiredCoordinateOrientation(orientation)
+    probe = sitk.Image([1, 1, 1], sitk.sitkUInt8)
+    probe.SetDirection(direction)
+    orient_filter.Execute(probe)
+    return orient_filter.GetPermuteOrder(), orient_filter.GetFlipAxes()
+
+def _index_to_point(origin, spacing, direction, index):
+    return np.asarray(origin) + np.reshape(direction, (3, 3)) @ (np.asarray(index) * spacing)
+
+def oriented_geometry(size, origin, spacing, direction, perm, flip):
+    """Size, origin, spacing and direction of the volume after DICOMOrient, without the pixels."""
+    matrix = np.reshape(direction, (3, 3))
+    corner = [0, 0, 0]
+    for i in range(3):
+        if flip[i]:
+            corner[perm[i]] = size[perm[i]] - 1
+    new_direction = np.stack([matrix[:, perm[i]] * (-1 if flip[i] else 1) for i in range(3)], axis=1)
+    return ([size[p] for p in perm], list(_index_to_point(origin, spacing, direction, corner)),
+            [spacing[p] for p in perm], list(new_direction.ravel()))
+
+def input_layout(oriented, perm, flip):
+    """View of an oriented (z, y, x) array in the layout of the input volume (writes go through)."""
+    axes = [2 - perm[2 - k] for k in range(3)]
+    flips = [k for k in range(3) if flip[2 - k]]
+    view = np.flip(oriented, flips) if flips else oriented
+    return view.transpose(np.argsort(axes))
+
+def _input_params(step, perm):
+    """Step parameters expressed in the input axes (per axis radius, projection axis)."""
+    params = {k: v for k, v in step.items() if k != "type"}
+    if isinstance(params.get("radius"), (list, tuple)):
+        radius = [0, 0, 0]
+        for i in range(3):
+            radius[perm[i]] = params["radius"][i]
+        params["radius"] = radius
+    return params
+
+def _halo(steps, spacing):
+    return sum(HALO[step["type"]](spacing, **{k: v for k, v in step.items() if k != "type"}) for step in steps)
+
+def _slabs(depth, slab_size):
+    return [(z0, min(depth, z0 + slab_size)) for z0 in range(0, depth, slab_size)]
+
+def _run_slabs(read, depth, steps, halo, slab_size, perm, spacing, write):
+    """Run the local steps on overlapping slabs of the input, write(z0, z1, core of each slab)."""
+    for z0, z1 in _slabs(depth, slab_size):
+        lo, hi = max(0, z0 - halo), min(depth, z1 + halo)
+        image = sitk.GetImageFromArray(read(lo, hi))
+        image.SetSpacing(spacing)  # filters with physical parameters (bilateral, diffusion)
+        for step in steps:
+            image = FILTERS[step["type"]](image, **_input_params(step, perm))
+        write(z0, z1, sitk.GetArrayViewFromImage(image)[z0 - lo:z1 - lo])
+
+def stream_series(dicom_dir, profile, output_path, slab_size=32, tmp_dir=None):
+    """
+    Out-of-core run_profile: the series is read and filtered by overlapping z slabs (halo = median
+    radius), only a few slabs are in memory. For otsu_mip_threshold, the first pass spills the median
+    filtered slabs to a temporary memory map while accumulating the maximum projection; the second
+    pass thresholds them. The oriented result is written to output_path (.mhd/.raw, memory-mapped).
+    """
+    steps = profile["filters"]
+    for step in steps:
+        if step["type"] not in HALO and step["type"] not in GLOBAL_FILTERS:
+            raise ValueError(f"Filter '{step['type']}' cannot be streamed")
+    global_steps = [i for i, step in enumerate(steps) if step["type"] in GLOBAL_FILTERS]
+    if len(global_steps) > 1:
+        raise ValueError("Only one otsu_mip_threshold step can be streamed")
+
+    entry = series_entry(dicom_dir)
+    files, spacing = entry["files"], entry["spacing"]
+    size, depth = entry["size"], len(files)
+    orientation = profile.get("orientation")
+    perm, flip = orientation_mapping(entry["direction"], orientation) if orientation else ((0, 1, 2), (False,) * 3)
+    out_size, out_origin, out_spacing, out_direction = oriented_geometry(
+        size, entry["origin"], spacing, entry["direction"], perm, flip)
+
+    voi = profile.get("voi")
+    crop = bool(voi and voi.get("crop"))
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        result_path = os.path.join(tmp, "result.mhd") if crop else output_path
+        output = {}
+
+        def write_output(z0, z1, core):
+            if "volume" not in output:
+                output["volume"] = create_raw(result_path, out_size[::-1], core.dtype,
+                                              out_origin, out_spacing, out_direction)
+                output["target"] = input_layout(output["volume"].array, perm, flip)
+            output["target"][z0:z1] = core
+
+        def read_dicom(lo, hi):
+            return sitk.GetArrayFromImage(read_files(files[lo:hi]))
+
+        if not global_steps:
+            _run_slabs(read_dicom, depth, steps, _halo(steps, spacing), slab_size, perm, spacing, write_output)
+        else:
+            g = global_steps[0]
+            before, after = steps[:g], steps[g + 1:]
+            params = _input_params(steps[g], perm)
+            mip_axis = 2 - perm[params.get("axis", 2)]  # numpy axis of the projection in the input layout
+            spill, mip = {}, {}
+
+            def write_spill(z0, z1, core):
+                if "array" not in spill:
+                    spill["array"] = np.memmap(os.path.join(tmp, "spill.raw"), dtype=core.dtype, mode="w+",
+                                               shape=(depth,) + core.shape[1:])
+                    mip["array"] = np.zeros(core.shape[1:] if mip_axis == 0 else (depth, core.shape[3 - mip_axis]),
+                                            dtype=core.dtype)
+                spill["array"][z0:z1] = core
+                if mip_axis == 0:
+                    np.maximum(mip["array"], core.max(axis=0), out=mip["array"])
+                else:
+                    mip["array"][z0:z1] = core.max(axis=mip_axis)
+
+            _run_slabs(read_dicom, depth, before, _halo(before, spacing), slab_size, perm, spacing, write_spill)
+            # the Otsu threshold only depends on the values of the projection, not on its layout
+            value = otsu_value(sitk.GetImageFromArray(mip["array"]), params.get("offset", 1.5))
+            print(f"Streaming Otsu threshold of the maximum projection: {value:.2f}")
+            threshold = {"type": "threshold_below", "value": value}
+            _run_slabs(lambda lo, hi: np.asarray(spill["array"][lo:hi]), depth, [threshold] + after,
+                       _halo(after, spacing), slab_size, perm, spacing, write_output)
+            del spill["array"]
+
+        result = output["volume"]
+        if voi:
+            result = _apply_voi(result, voi["voi"], crop, output_path)
+        result.array.flush()
+        if crop:
+            del output["volume"], output["target"]
+    return result
+
+def _apply_voi(volume, voi, crop, output_path):
+    """apply_voi of profiles.py on a memory-mapped (z, y, x) volume."""
+    shape = volume.array.shape
+    lower = [max(0, voi[2*d]) for d in (2, 1, 0)]
+    upper = [min(shape[a], voi[2*d + 1] + 1) for a, d in enumerate((2, 1, 0))]
+    if crop:
+        region = volume.array[tuple(slice(l, u) for l, u in zip(lower, upper))]
+        origin = _index_to_point(volume.origin, volume.spacing, volume.direction, lower[::-1])
+        return write_raw(region, output_path, origin, volume.spacing, volume.direction)
+    # zero the outside of the VOI, one face slab at a time
+    for axis in range(3):
+        index = [slice(None)] * 3
+        index[axis] = slice(0, lower[axis])
+        volume.array[tuple(index)] = 0
+        index[axis] = slice(upper[axis], None)
+        volume.array[tuple(index)] = 0
+    return volume
@@ -0,0 +1,173 @@
+import argparse
+import itertools
+import json
+import os
+import shutil
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import SimpleITK as sitk
+
+STORE_SUFFIX = ".cvol"
+META_NAME = "meta.json"
+DEFAULT_CHUNKS = (64, 64, 64)
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, META_NAME))
+
+def _chunk_name(index):
+    return ".".join(str(i) for i in index)
+
+def _chunk_grid(shape, chunks):
+    return itertools.product(*(range(-(-s // c)) for s, c in zip(shape, chunks)))
+
+def write_volume(image, path, chunks=DEFAULT_CHUNKS, level=3, workers=8):
+    """
+    Write a SimpleITK image as a chunked volume store: a folder with meta.json (shape, dtype, chunks,
+    geometry) and one zlib compressed file per (z, y, x) chunk. Chunks holding only zeros are not
+    written (most of a binary mask). The store is written next to path and renamed when complete.
+    """
+    array = sitk.GetArrayViewFromImage(image)
+    meta = {
+        "shape": list(array.shape),
+        "dtype": array.dtype.str,
+        "chunks": list(chunks),
+        "compression": "zlib",
+        "level": level,
+        "fill_value": 0,
+        "origin": list(image.GetOrigin()),
+        "spacing": list(image.GetSpacing()),
+        "direction": list(image.GetDirection()),
+    }
+    tmp = f"{path}.{uuid.uuid4().hex}"
+    os.makedirs(tmp)
+
+    def write_chunk(index):
+        block = array[tuple(slice(i * c, (i + 1) * c) for i, c in zip(index, chunks))]
+        if not block.any():
+            return 0
+        data = zlib.compress(np.ascontiguousarray(block).tobytes(), level)
+        with open(os.path.join(tmp, _chunk_name(index)), "wb") as f:
+            f.write(data)
+        return len(data)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        stored = sum(pool.map(write_chunk, _chunk_grid(array.shape[:3], chunks)))
+    with open(os.path.join(tmp, META_NAME), "w") as f:
+        json.dump(meta, f, indent=1)
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+    print(f"Saved {path}: {stored / 1e6:.2f} MB compressed for {array.nbytes / 1e6:.2f} MB")
+    return path
+
+class ChunkedVolume:
+    """
+    Lazy reader of a chunked volume store. Indexing with (z, y, x) slices like a NumPy array only
+    decompresses the chunks intersecting the requested region:
+
+        volume = ChunkedVolume("Ax_3DTOF_output.cvol")
+        preview = volume[volume.shape[0] // 2]      # one axial slice
+        image = volume.read_voi((0, 75, 0, 127, 30, 110))
+    """
+
+    def __init__(self, path, workers=8):
+        with open(os.path.join(path, META_NAME)) as f:
+            self.meta = json.load(f)
+        self.path = path
+        self.workers = workers
+        self.shape = tuple(self.meta["shape"])
+        self.dtype = np.dtype(self.meta["dtype"])
+        self.chunks = tuple(self.meta["chunks"])
+
+    def _read_chunk(self, index):
+        chunk_path = os.path.join(self.path, _chunk_name(index))
+        lower = [i * c for i, c in zip(index, self.chunks)]
+        shape = tuple(min(c, s - l) for c, s, l in zip(self.chunks, self.shape, lower)) + self.shape[3:]
+        if not os.path.exists(chunk_path):
+            return np.full(shape, self.meta["fill_value"], dtype=self.dtype)
+        with open(chunk_path, "rb") as f:
+            return np.frombuffer(zlib.decompress(f.read()), dtype=self.dtype).reshape(shape)
+
+    def read_region(self, lower, upper):
+        """Voxels [lower, upper) in (z, y, x) order, decompressing only the intersecting chunks."""
+        out = np.empty(tuple(u - l for l, u in zip(lower, upper)) + self.shape[3:], dtype=self.dtype)
+        first = [l // c for l, c in zip(lower, self.chunks)]
+        last = [-(-u // c) for u, c in zip(upper, self.chunks)]
+
+        def copy_chunk(index):
+            block = self._read_chunk(index)
+            start = [i * c for i, c in zip(index, self.chunks)]
+            src, dst = [], []
+            for s, l, u, n in zip(start, lower, upper, block.shape):
+                a, b = max(l, s), min(u, s + n)
+                src.append(slice(a - s, b - s))
+                dst.append(slice(a - l, b - l))
+            out[tuple(dst)] = block[tuple(src)]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            list(pool.map(copy_chunk, itertools.product(*(range(f, l) for f, l in zip(first, last)))))
+        return out
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (3 - len(key))
+        lower, upper, squeeze = [], [], []
+        for axis, k in enumerate(key):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(self.shape[axis])
+                if step != 1:
+                    raise IndexError("Only contiguous slices are supported")
+                lower.append(start)
+                upper.append(max(start, stop))
+            else:
+                k = k + self.shape[axis] if k < 0 else k
+                lower.append(k)
+                upper.append(k + 1)
+                squeeze.append(axis)
+        region = self.read_region(lower, upper)
+        return region.squeeze(axis=tuple(squeeze)) if squeeze else region
+
+    def read_image(self, lower=(0, 0, 0), upper=None):
+        """SimpleITK image of the voxels [lower, upper) ((z, y, x) order) with its physical origin."""
+        upper = upper or self.shape[:3]
+        image = sitk.GetImageFromArray(self.read_region(lower, upper), isVector=len(self.shape) > 3)
+        image.SetSpacing(self.meta["spacing"])
+        image.SetDirection(self.meta["direction"])
+        # origin of the region: physical point of its first voxel in the full volume
+        full = sitk.Image([1, 1, 1], sitk.sitkUInt8)
+        full.SetOrigin(self.meta["origin"])
+        full.SetSpacing(self.meta["spacing"])
+        full.SetDirection(self.meta["direction"])
+        image.SetOrigin(full.TransformIndexToPhysicalPoint([int(i) for i in lower[::-1]]))
+        return image
+
+    def voi_region(self, voi):
+        """[lower, upper) (z, y, x) region of a VOI (xmin, xmax, ymin, ymax, zmin, zmax, inclusive), clamped."""
+        lower = [max(0, voi[2*d]) for d in (2, 1, 0)]
+        upper = [min(self.shape[a], voi[2*d + 1] + 1) for a, d in enumerate((2, 1, 0))]
+        return lower, upper
+
+    def read_voi(self, voi):
+        """Cropped SimpleITK image of a VOI (xmin, xmax, ymin, ymax, zmin, zmax, inclusive)."""
+        return self.read_image(*self.voi_region(voi))
+
+def store_size(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert volumes (.vtk, .nii, ...) to chunked volume stores.")
+    parser.add_argument("inputs", nargs="+")
+    parser.add_argument("--output-dir", default=None, help="Default: next to each input.")
+    parser.add_argument("--chunks", type=int, nargs=3, default=DEFAULT_CHUNKS, help="Chunk size (z y x).")
+    parser.add_argument("--level", type=int, default=3, help="zlib compression level.")
+    args = parser.parse_args()
+
+    for input_path in args.inputs:
+        name = os.path.splitext(os.path.basename(input_path))[0] + STORE_SUFFIX
+        output_path = os.path.join(args.output_dir or os.path.dirname(input_path), name)
+        write_volume(sitk.ReadImage(input_path), output_path, tuple(args.chunks), args.level)
+        print(f"{input_path}: {os.path.getsize(input_path) / 1e6:.2f} MB -> {store_size(output_path) / 1e6:.2f} MB")
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+CACHE_DIR = os.path.join("pipeline", "cache")
+CHUNK_SIZE = 1 << 20
+
+def _file_digest(path, cache_dir=CACHE_DIR):
+    """sha256 of a file, memoized on (path, size, mtime) so unchanged volumes are not re-read."""
+    st = os.stat(path)
+    memo_path = os.path.join(cache_dir, "digests",
+                             hashlib.sha1(os.path.abspath(path).encode()).hexdigest() + ".json")
+    if os.path.exists(memo_path):
+        with open(memo_path) as f:
+            memo = json.load(f)
+        if memo["size"] == st.st_size and memo["mtime_ns"] == st.st_mtime_ns:
+            return memo["digest"]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    os.makedirs(os.path.dirname(memo_path), exist_ok=True)
+    tmp = f"{memo_path}.{uuid.uuid4().hex}"
+    with open(tmp, "w") as f:
+        json.dump({"size": st.st_size, "mtime_ns": st.st_mtime_ns, "digest": digest}, f)
+    os.replace(tmp, memo_path)
+    return digest
+
+def hash_inputs(paths, cache_dir=CACHE_DIR):
+    """Content hash of a list of files, directories are hashed file by file (names + contents)."""
+    h = hashlib.sha256()
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, f) for f in os.listdir(path)
+                           if os.path.isfile(os.path.join(path, f)))
+            for f in files:
+                h.update(os.path.basename(f).encode())
+                h.update(_file_digest(f, cache_dir).encode())
+        else:
+            h.update(_file_digest(path, cache_dir).encode())
+    return h.hexdigest()
+
+def stage_key(stage, input_hash, params):
+    """Cache key of a stage: its name, the hash of its input data and its parameters."""
+    payload = json.dumps({"stage": stage, "inputs": input_hash, "params": params},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+def _copy(src, dst):
+    """
+    Copy a file or directory (.cvol) output through a temporary path renamed over dst. Never a
+    hard link: a script rewriting its output in place would otherwise write into the cache.
+    """
+    tmp = f"{dst}.{uuid.uuid4().hex}.tmp"
+    if os.path.isdir(src):
+        shutil.copytree(src, tmp)
+    else:
+        shutil.copy2(src, tmp)
+    if os.path.isdir(dst) and not os.path.islink(dst):
+        shutil.rmtree(dst)
+    os.replace(tmp, dst)
+
+class StageCache:
+    """Content-addressed store of stage outputs: cache/objects/<key[:2]>/<key>/<output files>."""
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, "objects")
+
+    def entry_dir(self, key):
+        return os.path.join(self.objects_dir, key[:2], key)
+
+    def restore(self, key, outputs):
+        """Put the cached outputs of key back at their pipeline paths, returns False on a miss."""
+        entry = self.entry_dir(key)
+        cached = [os.path.join(entry, os.path.basename(o)) for o in outputs]
+        if not all(os.path.exists(c) for c in cached):
+            return False
+        for c, o in zip(cached, outputs):
+            _copy(c, o)
+        return True
+
+    def store(self, key, outputs):
+        """Add the freshly computed outputs under key, written to a temporary dir then renamed."""
+        entry = self.entry_dir(key)
+        if os.path.exists(entry):
+            return
+        tmp = f"{entry}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(tmp)
+        for o in outputs:
+            _copy(o, os.path.join(tmp, os.path.basename(o)))
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # another worker stored the same entry meanwhile
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def run(self, stage, inputs, params, outputs, func, force=False):
+        """Restore outputs from the cache or run func() and store them, returns (key, hit)."""
+        key = stage_key(stage, hash_inputs(inputs, self.cache_dir), params)
+        if not force and self.restore(key, outputs):
+            return key, True
+        # remove previous outputs so a failed stage does not leave stale ones behind
+        for o in outputs:
+            _remove(o)
+        func()
+        self.store(key, outputs)
+        return key, False
@@ -0,0 +1,158 @@
+import argparse
+import ast
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from cache import StageCache
+
+# The stage scripts are not packages, make their folders importable
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DIRS = [os.path.join(ROOT, sub) for sub in ("3D", "recalage", "image_filtering")]  # import order
+for source_dir in reversed(SOURCE_DIRS):
+    sys.path.insert(0, source_dir)
+
+DICOM_DIR = "DICOM"
+FIXED_SERIES = "Ax_3DTOF"
+FILTERED_DIR = os.path.join("image_filtering", "filtered_dicom")
+REGISTERED_DIR = os.path.join("recalage", "registered_surface")
+TRANSFORM_DIR = os.path.join("recalage", "transforms")
+SURFACE_DIR = os.path.join("3D", "surface_output")
+SURFACE_THRESHOLD = 1
+
+def init_worker(threads_per_worker):
+    """Import the stage modules once per worker, they stay loaded for every series it handles."""
+    global correct_noise, profiles, registration_sitk, marching_cubes
+    import SimpleITK as sitk
+    import correct_noise
+    import profiles
+    import registration_sitk
+    import marching_cubes
+    # avoid oversubscribing the cores, each worker already runs in parallel
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(threads_per_worker)
+    marching_cubes.UseThreads(threads_per_worker)
+
+def _local_imports(path):
+    """Repository modules imported by a script (searched in its folder, then in SOURCE_DIRS)."""
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split(".")[0])
+    found = []
+    for name in names:
+        for directory in [os.path.dirname(path)] + SOURCE_DIRS:
+            candidate = os.path.join(directory, name + ".py")
+            if os.path.isfile(candidate):
+                found.append(candidate)
+                break
+    return found
+
+def stage_sources(*modules):
+    """
+    The stage scripts and the repository modules they import, recursively, are part of the
+    inputs: editing the code of a stage or of one of its helpers invalidates its cache entries.
+    """
+    sources = set()
+    pending = [os.path.abspath(module.__file__) for module in modules]
+    while pending:
+        path = pending.pop()
+        if path not in sources:
+            sources.add(path)
+            pending += _local_imports(path)
+    return sorted(sources)
+
+def run_stage(cache, series, stage, inputs, params, outputs, func, force=False):
+    """Restore the outputs from the cache when inputs and parameters are unchanged, else run func()."""
+    start = time.perf_counter()
+    key, hit = cache.run(stage, inputs, params, outputs, func, force)
+    elapsed = time.perf_counter() - start
+    if hit:
+        print(f"[{series}] {stage}: cache hit {key[:12]}, skipped")
+    else:
+        print(f"[{series}] {stage}: done in {elapsed:.1f}s (cached as {key[:12]})")
+    return elapsed
+
+def filter_series(series, force=False):
+    series_dir = os.path.join(DICOM_DIR, series)
+    output = os.path.join(FILTERED_DIR, f"{series}_output.vtk")
+    elapsed = run_stage(StageCache(), series, "filter",
+                        [series_dir] + stage_sources(correct_noise, profiles),
+                        correct_noise.filter_parameters(series_dir), [output],
+                        lambda: correct_noise.correct_noise(series_dir, FILTERED_DIR), force)
+    return series, {"filter": elapsed}
+
+def register_and_mesh_series(series, fixed_path, force=False):
+    moving = os.path.join(FILTERED_DIR, f"{series}_output.vtk")
+    moving_base = os.path.basename(moving)
+    registered = os.path.join(REGISTERED_DIR, f"registered_{moving_base}")
+    transform = os.path.join(TRANSFORM_DIR, f"transform_{moving_base}.txt")
+    surface = os.path.join(SURFACE_DIR, f"registered_{series}_output_surface.stl")
+
+    surface_params = {
+        "threshold": SURFACE_THRESHOLD,
+        "smoothing_iterations": marching_cubes.SMOOTHING_ITERATIONS,
+        "smoothing_relaxation": marching_cubes.SMOOTHING_RELAXATION,
+    }
+    stages = [
+        ("register", [fixed_path, moving] + stage_sources(registration_sitk), registration_sitk.REGISTRATION_SETTINGS,
+         [registered, transform], lambda: registration_sitk.register(fixed_path, moving)),
+        ("surface", [registered] + stage_sources(marching_cubes), surface_params,
+         [surface], lambda: marching_cubes.extract_surface(registered, SURFACE_THRESHOLD, output_dir=SURFACE_DIR)),
+    ]
+    if series == FIXED_SERIES:
+        fixed_surface = os.path.join(SURFACE_DIR, f"{series}_output_surface.stl")
+        stages.append(("surface", [fixed_path] + stage_sources(marching_cubes), surface_params,
+                       [fixed_surface],
+                       lambda: marching_cubes.extract_surface(fixed_path, SURFACE_THRESHOLD, output_dir=SURFACE_DIR)))
+
+    cache = StageCache()
+    timings = {}
+    for stage, inputs, params, outputs, func in stages:
+        timings[os.path.basename(outputs[0])] = run_stage(cache, series, stage, inputs, params, outputs, func, force)
+    return series, timings
+
+def collect(futures):
+    for future in as_completed(futures):
+        series, timings = future.result()
+        print(f"[{series}] finished ({sum(timings.values()):.1f}s)")
+
+def list_series(dicom_dir):
+    return sorted(d for d in os.listdir(dicom_dir)
+                  if os.path.isdir(os.path.join(dicom_dir, d)) and os.listdir(os.path.join(dicom_dir, d)))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Filter, register and mesh every DICOM series in parallel.")
+    parser.add_argument("--series", nargs="+", help="Series to process (default: every non-empty DICOM/* folder).")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="Number of worker processes.")
+    parser.add_argument("--force", action="store_true", help="Recompute every stage even if it is in the cache.")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    os.chdir(ROOT)  # stage scripts use paths relative to the repository root
+    for d in (FILTERED_DIR, REGISTERED_DIR, TRANSFORM_DIR, SURFACE_DIR):
+        os.makedirs(d, exist_ok=True)
+
+    series_list = args.series or list_series(DICOM_DIR)
+    # the fixed image has to be filtered before any registration can start
+    to_filter = sorted(set(series_list) | {FIXED_SERIES})
+    fixed_path = os.path.join(FILTERED_DIR, f"{FIXED_SERIES}_output.vtk")
+
+    jobs = args.jobs or min(len(to_filter), os.cpu_count() or 1)
+    threads_per_worker = max(1, (os.cpu_count() or 1) // jobs)
+    print(f"Processing {series_list} with {jobs} workers ({threads_per_worker} threads each)")
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(threads_per_worker,)) as pool:
+        collect([pool.submit(filter_series, s, args.force) for s in to_filter])
+        collect([pool.submit(register_and_mesh_series, s, fixed_path, args.force) for s in series_list])
+
+    print(f"All DICOM series processed in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -13,13 +13,15 @@ def readVtuImages(path):
 
     mesh = meshio.read(path)
 
-    # Convert points
+    # Convert points (zero-copy, the numpy buffers are kept alive on the grid below)
+    points = np.ascontiguousarray(mesh.points, dtype=np.float32)
     vtk_points = vtk.vtkPoints()
-    vtk_points.SetData(numpy_support.numpy_to_vtk(mesh.points.astype(np.float32)))
+    vtk_points.SetData(numpy_support.numpy_to_vtk(points, deep=False))
 
     # Create the VTK unstructured grid
     image = vtk.vtkUnstructuredGrid()
     image.SetPoints(vtk_points)
+    numpy_refs = [points]
 
     # Add cells
     cell_type_map = {
@@ -31,28 +33,45 @@ def readVtuImages(path):
         "line": vtk.VTK_LINE,
     }
 
-    for cell_block in mesh.cells:
-        vtk_type = cell_type_map.get(cell_block.type)
-        if vtk_type is None:
-            continue
-        for cell in cell_block.data:
-            cell_ids = vtk.vtkIdList()
-            for idx in cell:
-                cell_ids.InsertNextId(idx)
-            image.InsertNextCell(vtk_type, cell_ids)
+    # Build the connectivity/offsets/types arrays of all the blocks at once with numpy
+    # and hand them to VTK in one call instead of one InsertNextCell per cell
+    kept = [i for i, block in enumerate(mesh.cells) if block.type in cell_type_map]
+    blocks = [mesh.cells[i] for i in kept]
+    if blocks:
+        id_type = numpy_support.get_vtk_to_numpy_typemap()[vtk.VTK_ID_TYPE]
+        connectivity = np.concatenate([block.data.ravel() for block in blocks]).astype(id_type, copy=False)
+        cell_sizes = np.concatenate([np.full(len(block.data), block.data.shape[1], dtype=id_type) for block in blocks])
+        offsets = np.zeros(len(cell_sizes) + 1, dtype=id_type)
+        np.cumsum(cell_sizes, out=offsets[1:])
+        cell_types = np.concatenate([np.full(len(block.data), cell_type_map[block.type], dtype=np.uint8)
+                                     for block in blocks])
+
+        cells = vtk.vtkCellArray()
+        cells.SetData(numpy_support.numpy_to_vtkIdTypeArray(offsets, deep=False),
+                      numpy_support.numpy_to_vtkIdTypeArray(connectivity, deep=False))
+        image.SetCells(numpy_support.numpy_to_vtk(cell_types, deep=False, array_type=vtk.VTK_UNSIGNED_CHAR), cells)
+        numpy_refs += [connectivity, offsets, cell_types]
 
     # Add point data
     for name, data in mesh.point_data.items():
-        vtk_array = numpy_support.numpy_to_vtk(data, deep=True)
+        data = np.ascontiguousarray(data)
+        vtk_array = numpy_support.numpy_to_vtk(data, deep=False)
         vtk_array.SetName(name)
         image.GetPointData().AddArray(vtk_array)
+        numpy_refs.append(data)
+
+    # Add cell data, one array per name over the kept blocks (same order as the cells)
+    for name, data in mesh.cell_data.items():
+        if not blocks:
+            break
+        data = np.ascontiguousarray(np.concatenate([data[i] for i in kept]))
+        vtk_array = numpy_support.numpy_to_vtk(data, deep=False)
+        vtk_array.SetName(name)
+        image.GetCellData().AddArray(vtk_array)
+        numpy_refs.append(data)
 
-    # Add cell data
-    for name, data in mesh.cell_data_dict.items():
-        for cell_type, arr in data.items():
-            vtk_array = numpy_support.numpy_to_vtk(arr, deep=True)
-            vtk_array.SetName(name)
-            image.GetCellData().AddArray(vtk_array)
+    # VTK does not own the shallow-copied buffers
+    image.numpy_refs = numpy_refs
     return image
 
 dim_val = 118
@@ -102,58 +121,60 @@ def vtu_to_sitk_image(unstructured_grid, scalar_name="Pressure", spacing=(1.0, 1
         sitk_image_z.SetSpacing(spacing)
         sitk_result = (sitk_image_x, sitk_image_y, sitk_image_z)
     return sitk_result
-"""
-# All 3-letter orientation codes from DICOM standard
-orientation_codes = [
-    "RIP", "LIP", "RSP", "LSP", "RIA", "LIA", "RSA", "LSA",
-    "IRP", "ILP", "SRP", "SLP", "IRA", "ILA", "SRA", "SLA",
-    "RPI", "LPI", "RAI", "LAI", "RPS", "LPS", "RAS", "LAS",
-    "PRI", "PLI", "ARI", "ALI", "PRS", "PLS", "ARS", "ALS",
-    "IPR", "SPR", "IAR", "SAR", "IPL", "SPL", "IAL", "SAL",
-    "PIR", "PSR", "AIR", "ASR", "PIL", "PSL", "AIL", "ASL"
-]
-
-# Input path
-vtu_path = "VTK_Files/Stokes.vtu"
-scalar_field = "Pressure"  # Replace with your scalar name if different
-
-# Read and convert
-unstructured = readVtuImages(vtu_path)
-sitk_img = vtu_to_sitk_image(unstructured, scalar_name=scalar_field)
-
-# Generate all orientations
-for orientation in orientation_codes:
+
+if __name__ == "__main__":
+    """
+    # All 3-letter orientation codes from DICOM standard
+    orientation_codes = [
+        "RIP", "LIP", "RSP", "LSP", "RIA", "LIA", "RSA", "LSA",
+        "IRP", "ILP", "SRP", "SLP", "IRA", "ILA", "SRA", "SLA",
+        "RPI", "LPI", "RAI", "LAI", "RPS", "LPS", "RAS", "LAS",
+        "PRI", "PLI", "ARI", "ALI", "PRS", "PLS", "ARS", "ALS",
+        "IPR", "SPR", "IAR", "SAR", "IPL", "SPL", "IAL", "SAL",
+        "PIR", "PSR", "AIR", "ASR", "PIL", "PSL", "AIL", "ASL"
+    ]
+
+    # Input path
+    vtu_path = "VTK_Files/Stokes.vtu"
+    scalar_field = "Pressure"  # Replace with your scalar name if different
+
+    # Read and convert
+    unstructured = readVtuImages(vtu_path)
+    sitk_img = vtu_to_sitk_image(unstructured, scalar_name=scalar_field)
+
+    # Generate all orientations
+    for orientation in orientation_codes:
+        oriented_img = sitk.DICOMOrient(sitk_img, orientation)
+        sitk.WriteImage(oriented_img, f"Stokes_image_{orientation}.vtk")
+        print(f"Saved: Stokes_image_{orientation}.vtk")
+    """
+    # Input path
+    vtu_path = "VTK_Files/Stokes.vtu"
+    scalar_field = "Pressure"  # Replace with your scalar name if different
+    field = "Velocity"
+
+    # Read and convert
+    unstructured = readVtuImages(vtu_path)
+
+    sitk_img = vtu_to_sitk_image(unstructured, scalar_name=scalar_field)
+    #get sitk_img orient
+    #image = sitk.ReadImage(sitk_img, sitk.sitkFloat32)
+
+    orientation = "SPR"
     oriented_img = sitk.DICOMOrient(sitk_img, orientation)
-    sitk.WriteImage(oriented_img, f"Stokes_image_{orientation}.vtk")
-    print(f"Saved: Stokes_image_{orientation}.vtk")
-"""
-# Input path
-vtu_path = "VTK_Files/Stokes.vtu"
-scalar_field = "Pressure"  # Replace with your scalar name if different
-field = "Velocity"
-
-# Read and convert
-unstructured = readVtuImages(vtu_path)
-
-sitk_img = vtu_to_sitk_image(unstructured, scalar_name=scalar_field)
-#get sitk_img orient
-#image = sitk.ReadImage(sitk_img, sitk.sitkFloat32)
-
-orientation = "SPR"
-oriented_img = sitk.DICOMOrient(sitk_img, orientation)
-sitk.WriteImage(oriented_img, f"VTK_Files/Stokes_image_{orientation}_pressure.vtk")
-print(f"Saved: VTK_Files/Stokes_image_{orientation}_pressure.vtk")
-
-vel_x, vel_y, vel_z = vtu_to_sitk_image(unstructured, scalar_name=field)
-orientation = "SPR"
-vel_x = sitk.DICOMOrient(vel_x, orientation)
-vel_y = sitk.DICOMOrient(vel_y, orientation)
-vel_z = sitk.DICOMOrient(vel_z, orientation)
-
-#save each velocity component
-sitk.WriteImage(vel_x, f"VTK_Files/Stokes_image_{orientation}_velocity_x.vtk")
-print(f"Saved: VTK_Files/Stokes_image_{orientation}_velocity_x.vtk")
-sitk.WriteImage(vel_y, f"VTK_Files/Stokes_image_{orientation}_velocity_y.vtk")
-print(f"Saved: VTK_Files/Stokes_image_{orientation}_velocity_y.vtk")
-sitk.WriteImage(vel_z, f"VTK_Files/Stokes_image_{orientation}_velocity_z.vtk")
-print(f"Saved: VTK_Files/Stokes_image_{orientation}_velocity_z.vtk")
\ No newline at end of file
+    sitk.WriteImage(oriented_img, f"VTK_Files/Stokes_image_{orientation}_pressure.vtk")
+    print(f"Saved: VTK_Files/Stokes_image_{orientation}_pressure.vtk")
+
+    vel_x, vel_y, vel_z = vtu_to_sitk_image(unstructured, scalar_name=field)
+    orientation = "SPR"
+    vel_x = sitk.DICOMOrient(vel_x, orientation)
+    vel_y = sitk.DICOMOrient(vel_y, orientation)
+    vel_z = sitk.DICOMOrient(vel_z, orientation)
+
+    #save each velocity component
+    sitk.WriteImage(vel_x, f"VTK_Files/Stokes_image_{orientation}_velocity_x.vtk")
+    print(f"Saved: VTK_Files/Stokes_image_{orientation}_velocity_x.vtk")
+    sitk.WriteImage(vel_y, f"VTK_Files/Stokes_image_{orientation}_velocity_y.vtk")
+    print(f"Saved: VTK_Files/Stokes_image_{orientation}_velocity_y.vtk")
+    sitk.WriteImage(vel_z, f"VTK_Files/Stokes_image_{orientation}_velocity_z.vtk")
+    print(f"Saved: VTK_Files/Stokes_image_{orientation}_velocity_z.vtk")
\ No newline at end of file
@@ -1,9 +1,15 @@
+import os
+import sys
 import SimpleITK as sitk
 
+# catalog of the DICOM series (image_filtering/dicom_index.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image_filtering"))
+from dicom_index import series_files
+
 dicom_dir = "DICOM/Sag_PCA/"
 
 reader = sitk.ImageSeriesReader()
-dicom_files = reader.GetGDCMSeriesFileNames(dicom_dir)
+dicom_files = series_files(dicom_dir)
 reader.SetFileNames(dicom_files)
 original_volume = reader.Execute()
 input_direction = original_volume.GetDirection()
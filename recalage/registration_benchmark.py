@@ -0,0 +1,159 @@
+import argparse
+import csv
+import glob
+import itertools
+import json
+import os
+import sys
+import time
+import numpy as np
+import SimpleITK as sitk
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image_filtering"))
+from dicom_loader import read_series_parallel
+from registration_sitk import OPTIMIZERS, REGISTRATION_SETTINGS, align
+
+# list of parameter grids, pyramid_levels 0 is the single level mode, n > 0 keeps the last n
+# levels of the REGISTRATION_SETTINGS pyramid (their level_sampling replaces sampling_percentage)
+DEFAULT_GRID = [
+    {"histogram_bins": [32, 64, 200], "sampling_strategy": ["RANDOM", "REGULAR"],
+     "sampling_percentage": [0.01, 0.05, 0.2, 0.5], "optimizer": list(OPTIMIZERS)},
+    {"pyramid_levels": [2, 3], "histogram_bins": [32, 200], "sampling_strategy": ["RANDOM", "REGULAR"],
+     "optimizer": list(OPTIMIZERS)},
+]
+LEVEL_KEYS = ("shrink_factors", "smoothing_sigmas", "level_iterations", "level_sampling")
+# known rigid motion of the synthetic moving images
+REFERENCE_ROTATION_DEG = (4.0, -3.0, 5.0)
+REFERENCE_TRANSLATION_MM = (5.0, -4.0, 3.0)
+
+def parameter_grid(grid):
+    """All combinations of a parameter grid, e.g. {"optimizer": [...], ...} -> [{"optimizer": ...}, ...]."""
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+def load_image(path, shrink=1):
+    """Float32 image of a DICOM series folder or an image file, optionally shrunk."""
+    image = read_series_parallel(path) if os.path.isdir(path) else sitk.ReadImage(path)
+    image = sitk.Cast(image, sitk.sitkFloat32)
+    return sitk.Shrink(image, [shrink] * 3) if shrink > 1 else image
+
+def reference_motion(image):
+    """Euler transform of REFERENCE_ROTATION_DEG / REFERENCE_TRANSLATION_MM around the image center."""
+    center = image.TransformContinuousIndexToPhysicalPoint([(s - 1) / 2 for s in image.GetSize()])
+    return sitk.Euler3DTransform(center, *np.radians(REFERENCE_ROTATION_DEG), REFERENCE_TRANSLATION_MM)
+
+def displaced(image, transform):
+    """
+    Same pixels with the geometry moved by a rigid transform: the voxel at p in image is at
+    transform(p) in the result, so transform is the exact fixed -> moving registration.
+    """
+    moved = sitk.Image(image)
+    rotation = np.reshape(transform.GetMatrix(), (3, 3))
+    moved.SetOrigin(transform.TransformPoint(image.GetOrigin()))
+    moved.SetDirection(list((rotation @ np.reshape(image.GetDirection(), (3, 3))).ravel()))
+    return moved
+
+def target_points(image, count=5):
+    """count^3 physical points regularly spread over the central 80% of the image."""
+    axes = [np.linspace(0.1, 0.9, count) * (s - 1) for s in image.GetSize()]
+    return [image.TransformContinuousIndexToPhysicalPoint([float(c) for c in index])
+            for index in np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)]
+
+def target_registration_error(transform, reference, points):
+    """(mean, max) distance in mm between the points mapped by transform and by reference."""
+    errors = [np.linalg.norm(np.subtract(transform.TransformPoint(p), reference.TransformPoint(p))) for p in points]
+    return float(np.mean(errors)), float(np.max(errors))
+
+def benchmark_settings(params, seed):
+    """Registration settings of one grid point."""
+    settings = {**REGISTRATION_SETTINGS, "sampling_seed": seed,
+                **{k: v for k, v in params.items() if k != "pyramid_levels"}}
+    levels = params.get("pyramid_levels", 0)
+    if levels:
+        if levels > len(REGISTRATION_SETTINGS["shrink_factors"]):
+            raise ValueError(f"At most {len(REGISTRATION_SETTINGS['shrink_factors'])} pyramid levels")
+        settings["pyramid"] = True
+        for key in LEVEL_KEYS:
+            settings[key] = REGISTRATION_SETTINGS[key][-levels:]
+    return settings
+
+def run_case(name, fixed_image, moving_image, reference, grid, seed):
+    """Every configuration of grid on one (fixed, moving, reference transform): returns the result rows."""
+    points = target_points(fixed_image)
+    rows = []
+    for params in (p for g in grid for p in parameter_grid(g)):
+        settings = benchmark_settings(params, seed)
+        iterations = []
+        start = time.perf_counter()
+        initial, final, metric = align(fixed_image, moving_image, settings, lambda method: iterations.append(1))
+        elapsed = time.perf_counter() - start
+        tre_mean, tre_max = target_registration_error(final, reference, points)
+        rows.append({
+            "input": name,
+            "size": "x".join(str(s) for s in fixed_image.GetSize()),
+            "params": json.dumps(params),
+            "optimizer": settings["optimizer"],
+            "histogram_bins": settings["histogram_bins"],
+            "sampling_strategy": settings["sampling_strategy"],
+            "sampling_percentage": settings["level_sampling"] if settings["pyramid"] else settings["sampling_percentage"],
+            "pyramid_levels": len(settings["shrink_factors"]) if settings["pyramid"] else 0,
+            "time_s": elapsed,
+            "iterations": len(iterations),
+            "metric": metric,
+            "initial_tre_mm": target_registration_error(initial, reference, points)[0],
+            "tre_mean_mm": tre_mean,
+            "tre_max_mm": tre_max,
+        })
+        print(f"{name} {params}: {elapsed:.2f}s, {len(iterations)} iterations, metric {metric:.4f}, "
+              f"TRE {tre_mean:.3f} mm (max {tre_max:.3f})")
+    return rows
+
+def write_results(rows, output_path):
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Saved {len(rows)} results to {output_path}")
+
+def print_fastest(rows, tolerance):
+    """Fastest configuration of each input whose maximum TRE is below tolerance (mm)."""
+    for name in dict.fromkeys(row["input"] for row in rows):
+        accurate = [row for row in rows if row["input"] == name and row["tre_max_mm"] <= tolerance]
+        if not accurate:
+            print(f"{name}: no configuration within {tolerance} mm")
+            continue
+        best = min(accurate, key=lambda row: row["time_s"])
+        print(f"{name}: fastest within {tolerance} mm: {best['params']} {best['time_s']:.2f}s, "
+              f"TRE {best['tre_mean_mm']:.3f} mm (max {best['tre_max_mm']:.3f})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Speed / accuracy of the registration settings of registration_sitk.py.")
+    parser.add_argument("inputs", nargs="*",
+                        help="Volumes or DICOM series folders (default: DICOM/*), each registered onto a copy of itself "
+                             "moved by a known rigid transform.")
+    parser.add_argument("--pair", nargs=3, action="append", default=[], metavar=("FIXED", "MOVING", "TRANSFORM"),
+                        help="Real pair with a reference transform file (e.g. written by a careful registration).")
+    parser.add_argument("--grid", default=None, help="JSON file with a list of parameter grids (default: DEFAULT_GRID).")
+    parser.add_argument("--shrink", type=int, default=1, help="Shrink factor of the volumes, for quick sweeps.")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the RANDOM metric sampling.")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Maximum TRE (mm) of an accurate configuration.")
+    parser.add_argument("--output", default=os.path.join("recalage", "benchmark", "registration.csv"))
+    args = parser.parse_args()
+
+    grid = DEFAULT_GRID
+    if args.grid:
+        with open(args.grid) as f:
+            grid = json.load(f)
+    inputs = args.inputs if args.inputs or args.pair else sorted(glob.glob(os.path.join("DICOM", "*", "")))
+    rows = []
+    for path in inputs:
+        fixed_image = load_image(path, args.shrink)
+        reference = reference_motion(fixed_image)
+        rows += run_case(path, fixed_image, displaced(fixed_image, reference), reference, grid, args.seed)
+    for fixed_path, moving_path, transform_path in args.pair:
+        rows += run_case(f"{fixed_path} <- {moving_path}", load_image(fixed_path, args.shrink),
+                         load_image(moving_path, args.shrink), sitk.ReadTransform(transform_path), grid, args.seed)
+    if rows:
+        write_results(rows, args.output)
+        print_fastest(rows, args.tolerance)
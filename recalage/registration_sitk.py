@@ -1,5 +1,6 @@
 import argparse
 import os
+import time
 import SimpleITK as sitk
 import matplotlib.pyplot as plt
 import numpy as np
@@ -8,70 +9,212 @@ import vtk
 import pyvista as pv
 import imageio.v2 as imageio
 
-def save_registration_gif(snapshots, fixed_image, output_path="registration.gif"):
-    frames = []
-    for iteration, img in snapshots:
-        ov = create_overlay_image(fixed_image, img)
-        fig, ax = plt.subplots(figsize=(6, 6))
-        ax.imshow(ov, origin='lower')
-        ax.set_title(f"Iteration {iteration}")
-        ax.axis('off')
-
-        # Save to a temporary image buffer
-        fig.canvas.draw()
-        frame = np.frombuffer(fig.canvas.tostring_rgb(), dtype=np.uint8)
-        frame = frame.reshape(fig.canvas.get_width_height()[::-1] + (3,))
-        frames.append(frame)
+# Registration settings, also used by the pipeline cache to know when to recompute
+REGISTRATION_SETTINGS = {
+    "histogram_bins": 200,
+    "sampling_strategy": "RANDOM",  # RANDOM, REGULAR or NONE (every voxel)
+    "sampling_percentage": 0.5,
+    "sampling_seed": sitk.sitkWallClock,
+    "optimizer": "gradient_descent",  # see OPTIMIZERS
+    "learning_rate": 0.3,
+    "min_step": 1e-4,  # regular_step
+    "gradient_tolerance": 1e-5,  # lbfgsb
+    "iterations": 4096,
+    "convergence_minimum": 1e-6,
+    "convergence_window": 10,
+    # coarse-to-fine mode: one registration per level, each with its own budget
+    "pyramid": False,
+    "shrink_factors": [4, 2, 1],
+    "smoothing_sigmas": [2, 1, 0],
+    "level_iterations": [300, 100, 50],
+    "level_sampling": [0.05, 0.1, 0.2],
+}
+
+def save_registration_gif(snapshots, output_path="registration.gif"):
+    """
+    Write the snapshots to a GIF frame by frame, snapshots can be a generator of
+    (iteration, overlays) with one overlay per orientation (see SlicePreview).
+    The figure is created once and only its images are updated for each frame.
+    """
+    fig, axes, images = None, None, None
+    with imageio.get_writer(output_path, mode="I", duration=0.5) as writer:  # 0.5s per frame
+        for iteration, overlays in snapshots:
+            if fig is None:
+                fig, axes = plt.subplots(1, len(overlays), figsize=(6*len(overlays), 6), squeeze=False)
+                images = [ax.imshow(ov, origin='lower') for ax, ov in zip(axes.flat, overlays)]
+                for ax in axes.flat:
+                    ax.axis('off')
+            else:
+                for im, ov in zip(images, overlays):
+                    im.set_data(ov)
+            fig.suptitle(f"Iteration {iteration}")
+
+            # Render to an image buffer and append it right away
+            fig.canvas.draw()
+            frame = np.asarray(fig.canvas.buffer_rgba())[..., :3]
+            writer.append_data(frame)
+
+    if fig is not None:
         plt.close(fig)
-
-    # Write to GIF
-    imageio.mimsave(output_path, frames, duration=0.5)  # 0.5s per frame
     print(f"Saved animation to {output_path}")
-    
-def get_numpy_slice(image, axis=2):
-    """Convert a 3D SimpleITK image to a 2D slice for display."""
-    array = sitk.GetArrayFromImage(image)  # Shape: [z, y, x]
-    if axis == 0:
-        return array[array.shape[0] // 2, :, :]
-    elif axis == 1:
-        return array[:, array.shape[1] // 2, :]
-    elif axis == 2:
-        return array[:, :, array.shape[2] // 2]
-    else:
-        raise ValueError("Axis must be 0, 1, or 2.")
 
-def create_overlay_image(fixed, moving):
-    """Create a red-blue overlay image from two images."""
-    fixed_np = get_numpy_slice(fixed)
-    moving_np = get_numpy_slice(moving)
+def snapshot_indices(n_iterations, interval=200):
+    """Iterations to visualize: 0, interval, 2*interval, ... and always the last one."""
+    if n_iterations == 0:
+        return []
+    indices = list(range(0, n_iterations, interval))
+    if indices[-1] != n_iterations - 1:
+        indices.append(n_iterations - 1)  # ensure final
+    return indices
+
+def iter_snapshots(preview, moving_image, transform_history, indices, fixed_parameters):
+    """Lazily build the slice overlays of the requested iterations only, yields (iteration, overlays)."""
+    for i in indices:
+        # Build a fresh transform object, centered like the optimized one
+        t = sitk.Euler3DTransform()
+        t.SetFixedParameters(fixed_parameters)
+        t.SetParameters(transform_history[i])
+        yield i, preview.overlays(moving_image, t)
 
+def overlay_arrays(fixed_np, moving_np):
+    """Red-blue overlay of two 2D arrays."""
     # Normalize to [0, 1] for display
     fixed_np = (fixed_np - fixed_np.min()) / (np.ptp(fixed_np) + 1e-5)
     moving_np = (moving_np - moving_np.min()) / (np.ptp(moving_np) + 1e-5)
 
-    rgb = np.zeros((*fixed_np.shape, 3))
+    rgb = np.zeros((*fixed_np.shape, 3), dtype=np.float32)
     rgb[..., 0] = fixed_np  # Red channel
     rgb[..., 2] = moving_np  # Blue channel
     return rgb
 
+def central_slice(image, axis=2):
+    """One voxel thick sub-image holding the central slice along numpy axis (0: z, 1: y, 2: x)."""
+    if axis not in (0, 1, 2):
+        raise ValueError("Axis must be 0, 1, or 2.")
+    dim = 2 - axis  # numpy arrays are [z, y, x]
+    size = list(image.GetSize())
+    index = [0, 0, 0]
+    index[dim] = size[dim] // 2
+    size[dim] = 1
+    return sitk.RegionOfInterest(image, size, index)
+
+class SlicePreview:
+    """
+    Overlays of the central slices of the fixed image with the moving image, where the moving image
+    is resampled on the slice planes only (not on the whole fixed grid), so a frame costs a few
+    2D resamples instead of a full 3D one.
+    """
+
+    def __init__(self, fixed_image, axes=(0, 1, 2)):
+        self.planes = []
+        for axis in axes:
+            plane = central_slice(fixed_image, axis)
+            self.planes.append((axis, plane, np.take(sitk.GetArrayViewFromImage(plane), 0, axis=axis)))
+
+    def overlays(self, moving_image, transform):
+        """One red-blue overlay per orientation for the moving image mapped with transform."""
+        result = []
+        for axis, plane, fixed_np in self.planes:
+            moving_plane = sitk.Resample(moving_image, plane, transform,
+                                         sitk.sitkLinear, 0.0, moving_image.GetPixelID())
+            result.append(overlay_arrays(fixed_np, np.take(sitk.GetArrayViewFromImage(moving_plane), 0, axis=axis)))
+        return result
+
 def compute_center(image):
     index_center = [size // 2 for size in image.GetSize()]
     return image.TransformIndexToPhysicalPoint(index_center)
 
-def main():
-    parser = argparse.ArgumentParser(description="Register two VTK images using SimpleITK.")
-    parser.add_argument("--fixed", required=True, help="Path to the fixed VTK image.")
-    parser.add_argument("--moving", required=True, help="Path to the moving VTK image.")
-    parser.add_argument("--visualize", required=False, action="store_true", help="Get visualization output.")
-    args = parser.parse_args()
-
-    fixed_image = sitk.ReadImage(args.fixed, sitk.sitkFloat32)
-    if "test" in args.moving:
-        moving_image = pv.read(args.moving)
+# optimizer name -> function(registration method, settings, iterations)
+OPTIMIZERS = {
+    "gradient_descent": lambda method, settings, iterations: method.SetOptimizerAsGradientDescent(
+        learningRate=settings["learning_rate"],
+        numberOfIterations=iterations,
+        convergenceMinimumValue=settings["convergence_minimum"],
+        convergenceWindowSize=settings["convergence_window"]),
+    "regular_step": lambda method, settings, iterations: method.SetOptimizerAsRegularStepGradientDescent(
+        learningRate=settings["learning_rate"],
+        minStep=settings["min_step"],
+        numberOfIterations=iterations),
+    "lbfgsb": lambda method, settings, iterations: method.SetOptimizerAsLBFGSB(
+        gradientConvergenceTolerance=settings["gradient_tolerance"],
+        numberOfIterations=iterations),
+}
+
+def setup_registration(settings, iterations, sampling_percentage, shrink_factor=None, smoothing_sigma=None):
+    """Mattes MI registration, optionally on a single shrunk/smoothed level."""
+    registration_method = sitk.ImageRegistrationMethod()
+    registration_method.SetMetricAsMattesMutualInformation(numberOfHistogramBins=settings["histogram_bins"])
+    registration_method.SetMetricSamplingStrategy(getattr(registration_method, settings["sampling_strategy"]))
+    if settings["sampling_strategy"] != "NONE":
+        registration_method.SetMetricSamplingPercentage(sampling_percentage, settings["sampling_seed"])
+    OPTIMIZERS[settings["optimizer"]](registration_method, settings, iterations)
+    if settings["optimizer"] != "lbfgsb":  # LBFGSB does not support scales
+        registration_method.SetOptimizerScalesFromPhysicalShift()
+    registration_method.SetInterpolator(sitk.sitkLinear)
+    if shrink_factor is not None:
+        registration_method.SetShrinkFactorsPerLevel(shrinkFactors=[shrink_factor])
+        registration_method.SetSmoothingSigmasPerLevel(smoothingSigmas=[smoothing_sigma])
+        registration_method.SmoothingSigmasAreSpecifiedInPhysicalUnitsOn()
+    return registration_method
+
+def run_pyramid(fixed_image, moving_image, initial_transform, settings, iteration_callback=None):
+    """
+    Coarse-to-fine registration: each level is its own registration with its own iteration
+    budget and sampling percentage, started from the transform found at the previous level.
+    Returns (transform, metric value of the last level).
+    """
+    keys = ("shrink_factors", "smoothing_sigmas", "level_iterations", "level_sampling")
+    lengths = {len(settings[k]) for k in keys}
+    if len(lengths) != 1 or 0 in lengths:
+        raise ValueError(f"{', '.join(keys)} must have one value per pyramid level (at least one level).")
+    levels = zip(*(settings[k] for k in keys))
+
+    transform = sitk.Euler3DTransform(initial_transform)
+    for level, (shrink, sigma, iterations, sampling) in enumerate(levels):
+        method = setup_registration(settings, iterations, sampling, shrink, sigma)
+        method.SetInitialTransform(transform, inPlace=True)
+        if iteration_callback is not None:
+            method.AddCommand(sitk.sitkIterationEvent, lambda m=method: iteration_callback(m))
+        start = time.perf_counter()
+        method.Execute(fixed_image, moving_image)
+        print(f"Level {level} (shrink {shrink}, sigma {sigma}, sampling {sampling}): "
+              f"{method.GetOptimizerIteration()} iterations, metric {method.GetMetricValue():.5f}, "
+              f"{time.perf_counter() - start:.2f}s")
+    # same transform file layout as the single level mode
+    return sitk.CompositeTransform(transform), method.GetMetricValue()
+
+def align(fixed_image, moving_image, settings, iteration_callback=None):
+    """
+    Centered rigid initialization then registration (single level or pyramid),
+    returns (initial transform, final transform, final metric value).
+    """
+    initial_transform = sitk.CenteredTransformInitializer(
+        fixed_image,
+        moving_image,
+        sitk.Euler3DTransform(),
+        sitk.CenteredTransformInitializerFilter.GEOMETRY
+    )
+    if settings["pyramid"]:
+        final_transform, metric = run_pyramid(fixed_image, moving_image, initial_transform, settings, iteration_callback)
+    else:
+        registration_method = setup_registration(settings, settings["iterations"], settings["sampling_percentage"])
+        registration_method.SetInitialTransform(initial_transform, inPlace=False)
+        if iteration_callback is not None:
+            registration_method.AddCommand(sitk.sitkIterationEvent, lambda: iteration_callback(registration_method))
+        final_transform = registration_method.Execute(fixed_image, moving_image)
+        metric = registration_method.GetMetricValue()
+    return initial_transform, final_transform, metric
+
+def register(fixed_path, moving_path, visualize=False, settings=None, gif_path=None, snapshot_interval=200):
+    """Rigidly register moving_path onto fixed_path, writes the transform and the registered image."""
+    settings = {**REGISTRATION_SETTINGS, **(settings or {})}
+    fixed_image = sitk.ReadImage(fixed_path, sitk.sitkFloat32)
+    if "test" in moving_path:
+        moving_image = pv.read(moving_path)
         moving_image = sitk.ReadImage(moving_image, sitk.sitkFloat32)
     else:
-        moving_image = sitk.ReadImage(args.moving, sitk.sitkFloat32)
-    #moving_image = itk.imread(args.moving, itk.F)
+        moving_image = sitk.ReadImage(moving_path, sitk.sitkFloat32)
+    #moving_image = itk.imread(moving_path, itk.F)
     #reader = vtk.vtkXMLUnstructuredGridReader()
     #reader.SetFileName("grid.vtk")
 
@@ -86,78 +229,31 @@ def main():
     fixed_center = compute_center(fixed_image)
     moving_center = compute_center(moving_image)
 
-    initial_transform = sitk.CenteredTransformInitializer(
-        fixed_image,
-        moving_image,
-        sitk.Euler3DTransform(),
-        sitk.CenteredTransformInitializerFilter.GEOMETRY
-    )
-    #initial_transform = sitk.Euler3DTransform(initial_transform)
-
-    # Setup registration
-    registration_method = sitk.ImageRegistrationMethod()
-    registration_method.SetMetricAsMattesMutualInformation(numberOfHistogramBins=200)
-    registration_method.SetMetricSamplingStrategy(registration_method.RANDOM)
-    registration_method.SetMetricSamplingPercentage(0.5)
-    registration_method.SetOptimizerAsGradientDescent(
-        learningRate=0.3,
-        numberOfIterations=4096,
-        convergenceMinimumValue=1e-6,
-        convergenceWindowSize=10
-    )
-    registration_method.SetOptimizerScalesFromPhysicalShift()
-    registration_method.SetInterpolator(sitk.sitkLinear)
-    registration_method.SetInitialTransform(initial_transform, inPlace=False)
-    
     # Containers for history
     metric_history = []
     transform_history = []
 
-    def iteration_callback():
+    def iteration_callback(method):
         # Called at every optimizer iteration
-        metric  = registration_method.GetMetricValue()
-        params  = registration_method.GetOptimizerPosition()  # current transform parameters
+        metric  = method.GetMetricValue()
+        params  = method.GetOptimizerPosition()  # current transform parameters
         metric_history.append(metric)
         transform_history.append(params)
 
-    # Attach to the registration method
-    registration_method.AddCommand(sitk.sitkIterationEvent, iteration_callback)
-
-    # Initial resampling
-    initial_resampled = sitk.Resample(
-        moving_image,
-        fixed_image,
-        initial_transform,
-        sitk.sitkLinear,
-        0.0,
-        moving_image.GetPixelID()
-    )
-
     # Execute registration
-    final_transform = registration_method.Execute(fixed_image, moving_image)
+    start = time.perf_counter()
+    initial_transform, final_transform, _ = align(fixed_image, moving_image, settings, iteration_callback)
+    print(f"Registration time: {time.perf_counter() - start:.2f}s ({len(transform_history)} iterations)")
     
-    # Choose indices to visualize (e.g., 0, 100, 200, … up to last)
-    interval = 200
-    indices  = list(range(0, len(transform_history), interval))
-    indices.append(len(transform_history)-1)  # ensure final
-
-    # Generate resampled snapshots
-    snapshots = []
-    print(len(transform_history))
+    # Choose indices to visualize (e.g., 0, 200, 400, … up to last), resampled only when needed
+    indices = snapshot_indices(len(transform_history), snapshot_interval)
     print("Transform history indices:", indices)
-    for i in range(len(transform_history)):
-        params = transform_history[i]
-        # Build a fresh transform object
-        t = sitk.Euler3DTransform()
-        t.SetParameters(params)
-        # Resample moving at this intermediate transform
-        img_i = sitk.Resample(
-            moving_image, fixed_image, t,
-            sitk.sitkLinear, 0.0, moving_image.GetPixelID()
-        )
-        snapshots.append((i, img_i))
-        
-    print("Snapshots length:", len(snapshots))
+
+    preview = SlicePreview(fixed_image)
+
+    def snapshots():
+        return iter_snapshots(preview, moving_image, transform_history, indices,
+                              initial_transform.GetFixedParameters())
 
     # Final resampling
     resampled_image = sitk.Resample(
@@ -177,7 +273,7 @@ def main():
     print(final_transform)
     
     #write the transform to a file
-    moving_base = os.path.basename(args.moving)
+    moving_base = os.path.basename(moving_path)
     transform_file = "recalage/transforms/" + "transform_" + moving_base + ".txt"
     sitk.WriteTransform(final_transform, transform_file)
     print(f"Transform saved as: {transform_file}")
@@ -200,9 +296,10 @@ def main():
     print("\nBefore registration pixel type:", moving_image.GetPixelIDTypeAsString())
     print("After registration pixel type:", resampled_image.GetPixelIDTypeAsString())
 
-    if args.visualize:
-        before_overlay = create_overlay_image(fixed_image, initial_resampled)
-        after_overlay = create_overlay_image(fixed_image, resampled_image)
+    if visualize:
+        # default view: central slice along the last numpy axis
+        before_overlay = preview.overlays(moving_image, initial_transform)[-1]
+        after_overlay = preview.overlays(moving_image, final_transform)[-1]
 
         # Plot results
         plt.figure(figsize=(16, 8))
@@ -231,15 +328,13 @@ def main():
         plt.show()
 
         # 3B) Plot overlays at selected iterations
-        n = len(snapshots)
+        n = len(indices)
         cols = min(4, n)
         rows = int(np.ceil(n/cols))
-        fig, axes = plt.subplots(rows, cols, figsize=(4*cols, 4*rows))
+        fig, axes = plt.subplots(rows, cols, figsize=(4*cols, 4*rows), squeeze=False)
 
-        for ax, (it, img_i) in zip(axes.flat, snapshots):
-            # build overlay (reuse your create_overlay_image)
-            ov = create_overlay_image(fixed_image, img_i)
-            ax.imshow(ov, origin='lower')
+        for ax, (it, overlays) in zip(axes.flat, snapshots()):
+            ax.imshow(overlays[-1], origin='lower')
             ax.set_title(f"Iter {it}")
             ax.axis('off')
 
@@ -249,15 +344,43 @@ def main():
 
         plt.tight_layout()
         plt.show()
-        
-        save_registration_gif(snapshots, fixed_image)
+
+    if visualize or gif_path:
+        save_registration_gif(snapshots(), gif_path or "registration.gif")
 
     # Save result
-    moving_base = os.path.basename(args.moving)
+    moving_base = os.path.basename(moving_path)
     output_name = f"registered_{moving_base}"
     output_folder = "recalage/registered_surface/"
     sitk.WriteImage(resampled_image, output_folder+output_name)
     print(f"Registered image saved as: {output_name}")
+    return output_folder+output_name, transform_file
+
+def main():
+    parser = argparse.ArgumentParser(description="Register two VTK images using SimpleITK.")
+    parser.add_argument("--fixed", required=True, help="Path to the fixed VTK image.")
+    parser.add_argument("--moving", required=True, help="Path to the moving VTK image.")
+    parser.add_argument("--visualize", required=False, action="store_true", help="Get visualization output.")
+    parser.add_argument("--gif", help="Write the registration animation to this GIF (implied by --visualize).")
+    parser.add_argument("--snapshot-interval", type=int, default=200, help="Iterations between two animation frames.")
+    parser.add_argument("--histogram-bins", type=int, help="Mattes mutual information bins (default 200).")
+    parser.add_argument("--sampling-strategy", choices=["RANDOM", "REGULAR", "NONE"], help="Metric sampling (default RANDOM).")
+    parser.add_argument("--sampling-percentage", type=float, help="Metric sampling percentage of the single level mode (default 0.5).")
+    parser.add_argument("--optimizer", choices=list(OPTIMIZERS), help="Optimizer (default gradient_descent).")
+    parser.add_argument("--pyramid", action="store_true", help="Coarse-to-fine multi-resolution registration.")
+    parser.add_argument("--shrink-factors", type=int, nargs="+", help="Shrink factor of each pyramid level (default 4 2 1).")
+    parser.add_argument("--smoothing-sigmas", type=float, nargs="+", help="Smoothing sigma (mm) of each pyramid level (default 2 1 0).")
+    parser.add_argument("--level-iterations", type=int, nargs="+", help="Iteration budget of each pyramid level (default 300 100 50).")
+    parser.add_argument("--level-sampling", type=float, nargs="+", help="Metric sampling percentage of each pyramid level (default 0.05 0.1 0.2).")
+    args = parser.parse_args()
+
+    settings = {"pyramid": args.pyramid}
+    for key in ("histogram_bins", "sampling_strategy", "sampling_percentage", "optimizer",
+                "shrink_factors", "smoothing_sigmas", "level_iterations", "level_sampling"):
+        if getattr(args, key) is not None:
+            settings[key] = getattr(args, key)
+    register(args.fixed, args.moving, visualize=args.visualize, settings=settings,
+             gif_path=args.gif, snapshot_interval=args.snapshot_interval)
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,11 @@
+import os
+import sys
 import SimpleITK as sitk
 import subprocess
-import os
+
+# catalog of the DICOM series (image_filtering/dicom_index.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image_filtering"))
+from dicom_index import series_files
 
 def open_dicom_series_with_fiji(dicom_dir, fiji_path):
     """
@@ -14,7 +19,7 @@ def open_dicom_series_with_fiji(dicom_dir, fiji_path):
     if not os.path.exists(file_path):
         print("Création du fichier temporaire")
         reader = sitk.ImageSeriesReader()
-        dicom_series = reader.GetGDCMSeriesFileNames(dicom_dir)
+        dicom_series = series_files(dicom_dir)
         reader.SetFileNames(dicom_series)
         
         # Lecture de la série d'images en un volume 3D